@@ -16,4 +16,8 @@ CEND = '\033[0m'        # Reset to default
 # Log Prefix for normal use
 LOG_PREFIX = f"{CEND}[IMGNR Utils]{CEND}"
 WARN_PREFIX = f"{CYELLOW}[IMGNR Utils]{CEND}"
-ERR_PREFIX  = f"{CRED}[IMGNR Utils ERROR]{CEND}"
\ No newline at end of file
+ERR_PREFIX  = f"{CRED}[IMGNR Utils ERROR]{CEND}"
+
+# --- Profiling ---
+# Set to True to log per-stage timings (encode, metadata, filename, write) of the preview/save nodes
+PROFILE_TIMINGS = False
\ No newline at end of file
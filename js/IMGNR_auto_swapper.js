@@ -4,6 +4,7 @@
 // Image data transfer logic seamlessly passes images between swapped nodes.
 
 import { app } from "../../scripts/app.js";
+import { api } from "../../scripts/api.js";
 
 app.registerExtension({
     name: "Comfy.IMGNR.AutoSwapper",
@@ -130,7 +131,9 @@ app.registerExtension({
                     // Transfer from IMGNR Node -> Core Node
                     if (this.persistedImageData && (targetType === "PreviewImage" || targetType === "SaveImage")) {
                         newNode.imgs = [new Image()];
-                        newNode.imgs[0].src = this.persistedImageData.uri;
+                        const uri = this.persistedImageData.uri;
+                        // IMGNR previews may be preview store paths, which need the API prefix
+                        newNode.imgs[0].src = uri && uri.startsWith("/imgnr/") ? api.apiURL(uri) : uri;
                     }
 
                     graph.add(newNode);
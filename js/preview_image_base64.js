@@ -19,6 +19,17 @@
 // FIXED: Slider Value resets on tab changes / reloads
 // FIXED: Workflow metadata missing when clicking Manual Save Button
 // NEW: Bypass/Mute visual handling (Opacity toggle and invisible Glass Pane to block clicks)
+// NEW: Batch previews (Frame selector for List mode, Grid label)
+// NEW: Previews are short server URLs (content-addressed store); pinned references are inlined into JSON
+// NEW: Background autosave status ("imgnr-save-status" event)
+// OPTIMIZED: Metadata diff is computed server-side (only changed inputs + hashes are sent)
+// NEW: Batch autosave throughput in the save status
+// NEW: SAVE NOW retries while the server reports "busy"
+// OPTIMIZED: Pinned references live in the server's reference store (workflow JSON only keeps hash + url)
+// NEW: PSNR / SSIM of the shown image in the info bar (Compare node)
+// NEW: "duplicate" save status (skip_duplicates)
+// NEW: Progressive previews (thumbnail while running, swapped for the full preview when it arrives)
+// FIXED: A failed full preview is reported in the info bar instead of leaving the thumbnail unexplained
 
 
 import { app } from "../../../scripts/app.js";
@@ -28,9 +39,77 @@ import { api } from "../../../scripts/api.js";
 // Survives tab switching, dies on browser refresh.
 const sessionImageCache = new Map();
 
+// Background save results that arrived before the node's "executed" message (save_id -> detail)
+const earlySaveStatus = new Map();
+
+// Full resolution previews that arrived before the node's "executed" message (thumbnail url -> detail)
+const earlyFullPreviews = new Map();
+
+// --- HELPER: Resolve preview store paths ("/imgnr/preview/...") to the API url ---
+function resolveUri(uri) {
+    if (!uri || !uri.startsWith("/imgnr/")) return uri;
+    return api.apiURL(uri);
+}
+
+// --- HELPER: Hash of a preview store / reference store url ---
+function refHashFromUri(uri) {
+    const match = uri && uri.match(/\/imgnr\/(?:preview|ref)\/([0-9a-f]{32})/);
+    return match ? match[1] : null;
+}
+
+// --- HELPER: Pin / unpin an image in the server side reference store ---
+async function pinRef(nodeId, hash, pinned) {
+    const resp = await api.fetchApi("/imgnr/ref/pin", { method: "POST", body: JSON.stringify({ node_id: String(nodeId), hash, pinned }) });
+    return await resp.json();
+}
+
+// --- HELPER: Batch autosave throughput line ---
+function formatSaveStats(stats) {
+    if (!stats) return "";
+    let text = `${stats.images} images · ${stats.seconds.toFixed(2)}s · ${stats.images_per_sec} img/s · ${stats.mb_per_sec} MB/s`;
+    if (stats.failed) text += ` · ${stats.failed} failed`;
+    return text;
+}
+
 app.registerExtension({
     name: "Comfy.PreviewImageBase64Node.JS",
 
+    async setup() {
+        // Background autosave finished (or failed) after the node already executed
+        api.addEventListener("imgnr-save-status", ({ detail }) => {
+            if (!detail) return;
+            const node = app.graph.getNodeById(detail.node) ?? app.graph.getNodeById(Number(detail.node));
+            if (!node || !node.updateUIState) return;
+            if (node.pendingSaveId !== detail.save_id) {
+                earlySaveStatus.set(detail.save_id, detail);
+                if (earlySaveStatus.size > 64) earlySaveStatus.delete(earlySaveStatus.keys().next().value);
+                return;
+            }
+            node.pendingSaveId = null;
+            node.savedFilename = detail.success ? detail.saved_filename : null;
+            node.saveStatus = detail.save_status;
+            node.saveError = detail.success ? null : detail.message;
+            node.saveStats = detail.save_stats || null;
+            node.updateUIState();
+        });
+
+        // Progressive preview: thumbnail pushed while the node is still running
+        api.addEventListener("imgnr-preview-thumb", ({ detail }) => {
+            if (!detail) return;
+            const node = app.graph.getNodeById(detail.node) ?? app.graph.getNodeById(Number(detail.node));
+            if (node?.showThumbnail) node.showThumbnail(detail);
+        });
+
+        // ...and the full resolution preview once it is encoded
+        api.addEventListener("imgnr-preview-full", ({ detail }) => {
+            if (!detail) return;
+            const node = app.graph.getNodeById(detail.node) ?? app.graph.getNodeById(Number(detail.node));
+            if (node?.applyFullPreview && node.applyFullPreview(detail)) return;
+            earlyFullPreviews.set(detail.thumb, detail);
+            if (earlyFullPreviews.size > 64) earlyFullPreviews.delete(earlyFullPreviews.keys().next().value);
+        });
+    },
+
     async beforeRegisterNodeDef(nodeType, nodeData, app) {
         
         const isPreviewNode = nodeData.name === "PreviewImageBase64Node";
@@ -48,20 +127,48 @@ app.registerExtension({
                 const imgHolder = node.previewContainerElement.querySelector(".imgnr-img-holder");
                 if (!imgHolder) return;
 
-                const currentData = node.persistedImageData; 
+                const currentData = node.stagedPreview || node.persistedImageData; 
                 const refData = node.persistedRefData; 
                 const hasCurrent = !!(currentData && currentData.uri);
                 const hasRef = !!(refData && refData.uri);
 
                 // Update Dimensions Label
+                const frameCount = (hasCurrent && currentData.frames) ? currentData.frames.length : 0;
+                if (node.framePrevBtn) {
+                    const navDisplay = frameCount > 1 ? "block" : "none";
+                    node.framePrevBtn.style.display = navDisplay;
+                    node.frameNextBtn.style.display = navDisplay;
+                }
                 if (node.dimsLabel) {
-                     if (hasCurrent && currentData.width) {
+                     if (hasCurrent && frameCount > 1) {
+                         node.dimsLabel.textContent = `${(currentData.frameIndex || 0) + 1}/${frameCount} · ${currentData.width}x${currentData.height}`;
+                     } else if (hasCurrent && currentData.grid) {
+                         node.dimsLabel.textContent = `${currentData.width}x${currentData.height} · Grid of ${currentData.grid.count}`;
+                     } else if (hasCurrent && currentData.width) {
                          node.dimsLabel.textContent = `${currentData.width}x${currentData.height}`;
                      } else if (hasRef && refData.width) {
                          node.dimsLabel.textContent = `${refData.width}x${refData.height}`;
                      } else {
                          node.dimsLabel.textContent = "";
                      }
+                     // Compare node: scores of the shown image against the reference
+                     const metrics = hasCurrent ? currentData.metrics : null;
+                     if (metrics) {
+                         const frame = frameCount > 1 ? currentData.frames[currentData.frameIndex || 0] : null;
+                         const i = frame ? (frame.batch_index || 0) : 0;
+                         if (metrics.psnr[i] !== undefined) {
+                             node.dimsLabel.textContent += ` · PSNR ${metrics.psnr[i].toFixed(1)} dB · SSIM ${metrics.ssim[i].toFixed(3)}`;
+                             node.dimsLabel.title = `vs ${metrics.against} · MAE ${metrics.mae[i].toFixed(4)}` +
+                                 (metrics.psnr.length > 1 ? `\nBatch mean: PSNR ${metrics.mean.psnr.toFixed(1)} dB · MAE ${metrics.mean.mae.toFixed(4)} · SSIM ${metrics.mean.ssim.toFixed(3)}` : "");
+                         }
+                     } else {
+                         node.dimsLabel.title = "";
+                     }
+                     // Progressive preview whose full encode failed: the thumbnail is all there is
+                     if (hasCurrent && currentData.previewError) {
+                         node.dimsLabel.textContent += " · Thumbnail only (full preview failed)";
+                         node.dimsLabel.title = currentData.previewError;
+                     }
                 }
 
                 // Force visual updates of UI elements regardless of state
@@ -107,7 +214,7 @@ app.registerExtension({
                 // Reference (Background)
                 if (isComparisonActive) {
                     const imgRef = document.createElement("img");
-                    imgRef.src = refData.uri;
+                    imgRef.src = resolveUri(refData.uri);
                     imgRef.className = "imgnr-ref-layer";
                     Object.assign(imgRef.style, {
                         position: "absolute", top: "-1px", left: "-1px",
@@ -120,7 +227,7 @@ app.registerExtension({
 
                 // Current (Foreground) - Uses placeholder if no current image exists
                 const imgCur = document.createElement("img");
-                imgCur.src = hasCurrent ? currentData.uri : new URL("./placeholder.png", import.meta.url).href;
+                imgCur.src = hasCurrent ? resolveUri(currentData.uri) : new URL("./placeholder.png", import.meta.url).href;
                 imgCur.className = "imgnr-cur-layer";
                 Object.assign(imgCur.style, {
                     position: isComparisonActive ? "absolute" : "relative",
@@ -159,8 +266,7 @@ app.registerExtension({
  
                         if (node.diffBox) {
                             if (hasCurrent) {
-                                const diff = computeDiff(currentData.meta, refData.meta);
-                                node.diffBox.innerHTML = diff ? diff : "<span style='opacity:0.5'>No Input Changes</span>";
+                                renderMetaDiff(node, currentData.meta, refData.meta);
                             } else {
                                 node.diffBox.innerHTML = "<span style='opacity:0.5'>Waiting for new generation...</span>";
                             }
@@ -172,6 +278,56 @@ app.registerExtension({
                 node.setDirtyCanvas(true, true);
             }
 
+            // --- HELPER: Lock Reference to JSON ---
+            // The image is pinned in the server's reference store; the workflow only keeps its hash + url
+            async function lockRefData(node) {
+                const ref = node.persistedRefData;
+                if (!ref || !ref.uri) return;
+                const hash = ref.ref_hash || refHashFromUri(ref.uri);
+                const { frames, ...locked } = ref;
+                if (!hash) {
+                    // Reference restored from an older workflow (inlined data URI): keep it as it is
+                    node.properties["imgnr_locked_ref_data"] = locked;
+                    return;
+                }
+                if (node.properties["imgnr_locked_ref_data"]?.ref_hash === hash) return;
+                let result;
+                try {
+                    result = await pinRef(node.id, hash, true);
+                } catch (e) {
+                    result = { success: false, message: e };
+                }
+                if (!result.success) {
+                    console.warn("[IMGNR] Could not lock reference image:", result.message);
+                    return;
+                }
+                // Pin state may have changed while pinning
+                if (node.isPinned && node.persistedRefData === ref) {
+                    node.properties["imgnr_locked_ref_data"] = { ...locked, uri: result.url, ref_hash: hash };
+                } else {
+                    pinRef(node.id, hash, false).catch(() => {});
+                }
+            }
+
+            function unlockRefData(node) {
+                const hash = node.properties["imgnr_locked_ref_data"]?.ref_hash;
+                delete node.properties["imgnr_locked_ref_data"];
+                if (hash) pinRef(node.id, hash, false).catch(() => {});
+            }
+
+            // --- HELPER: Batch Frame Selector (List mode) ---
+            function showFrame(node, step) {
+                const data = node.persistedImageData;
+                if (!data || !data.frames || data.frames.length < 2) return;
+                const count = data.frames.length;
+                data.frameIndex = ((data.frameIndex || 0) + step + count) % count;
+                const frame = data.frames[data.frameIndex];
+                data.uri = frame.uri;
+                data.width = frame.width;
+                data.height = frame.height;
+                ensureImageExists(node);
+            }
+
             // --- HELPER: Smart String Diff (Clean) ---
             function getSmartStringDiff(str1, str2) {
                 if (str1 === str2) return null;
@@ -194,38 +350,48 @@ app.registerExtension({
                 return null;
             }
 
-            // --- HELPER: Compute Metadata Diff ---
-            function computeDiff(curr, ref) {
-                if (!curr || !ref || !curr.prompt || !ref.prompt) return "";
-                let changes = [];
-                const extractPrimitives = (p) => {
-                    let primitives = {};
-                    for (let key in p) {
-                        const inputs = p[key].inputs;
-                        if (!inputs) continue;
-                        for (let k in inputs) {
-                            const val = inputs[k];
-                            if (val !== null && typeof val !== 'object' && !Array.isArray(val)) primitives[k] = val;
-                        }
+            // --- HELPER: Format server-side Metadata Diff ---
+            function formatDiff(changes) {
+                if (!changes || !changes.length) return "";
+                return changes.map(c => {
+                    const k = c.input;
+                    const val1 = c.new; const val2 = c.old;
+                    if (typeof val1 === 'string' && typeof val2 === 'string' && val1.length > 20) {
+                        const smartDiff = getSmartStringDiff(val1, val2);
+                        return smartDiff ? `<b style='color:var(--component-node-border)'>${k}</b>: ${smartDiff}` : null;
                     }
-                    return primitives;
-                };
+                    return `<b style='color:var(--component-node-border)'>${k}</b>: <span style='color:#b24747'>${val2}</span> &rarr; <span style='color:#47b247'>${val1}</span>`;
+                }).filter(Boolean).join("<br>");
+            }
 
-                const p1 = extractPrimitives(curr.prompt);
-                const p2 = extractPrimitives(ref.prompt);
+            // --- HELPER: Render Metadata Diff ---
+            // Previous generation: diff already in the payload. Pinned/older reference: ask the server by hash.
+            function renderMetaDiff(node, curr, ref) {
+                const box = node.diffBox;
+                const show = (html) => { box.innerHTML = html ? html : "<span style='opacity:0.5'>No Input Changes</span>"; };
 
-                for (let k in p1) {
-                    if (p2[k] !== undefined && p1[k] != p2[k]) { 
-                        let val1 = p1[k]; let val2 = p2[k];
-                        if (typeof val1 === 'string' && typeof val2 === 'string' && val1.length > 20) {
-                            const smartDiff = getSmartStringDiff(val1, val2);
-                            if (smartDiff) changes.push(`<b style='color:var(--component-node-border)'>${k}</b>: ${smartDiff}`);
-                        } else {
-                            changes.push(`<b style='color:var(--component-node-border)'>${k}</b>: <span style='color:#b24747'>${val2}</span> &rarr; <span style='color:#47b247'>${val1}</span>`);
-                        }
-                    }
+                if (!curr || !ref || !curr.hash || !ref.hash) {
+                    box.innerHTML = "<span style='opacity:0.5'>No metadata to compare</span>";
+                    return;
                 }
-                return changes.join("<br>");
+                if (curr.hash === ref.hash) return show("");
+                if (curr.prev_hash === ref.hash) return show(formatDiff(curr.diff));
+
+                const pairKey = `${curr.hash}:${ref.hash}`;
+                if (node.metaDiffCache?.key === pairKey) return show(node.metaDiffCache.html);
+
+                box.innerHTML = "<span style='opacity:0.5'>Comparing...</span>";
+                api.fetchApi("/imgnr/meta_diff", { method: "POST", body: JSON.stringify({ current: curr.hash, reference: ref.hash }) })
+                    .then(resp => resp.json())
+                    .then(result => {
+                        const html = result.in_sync ? formatDiff(result.diff) : null;
+                        if (result.in_sync) node.metaDiffCache = { key: pairKey, html };
+                        // Only render if the images didn't change while waiting
+                        if (node.persistedImageData?.meta?.hash !== curr.hash || node.persistedRefData?.meta?.hash !== ref.hash) return;
+                        if (result.in_sync) show(html);
+                        else box.innerHTML = "<span style='opacity:0.5'>Reference metadata no longer on server</span>";
+                    })
+                    .catch(() => { box.innerHTML = "<span style='opacity:0.5'>Metadata diff unavailable</span>"; });
             }
 
             // --- 2. AUTO-RESIZE NODE ---
@@ -340,7 +506,24 @@ app.registerExtension({
                 });
                 this.dimsLabel = dimsLabel;
 
+                const makeFrameBtn = (text, side, step) => {
+                    const btn = document.createElement("button");
+                    btn.textContent = text;
+                    btn.title = "Browse batch images";
+                    Object.assign(btn.style, {
+                        position: "absolute", [side]: "4px", top: "50%", transform: "translateY(-50%)", display: "none",
+                        cursor: "pointer", borderRadius: "4px", padding: "0px 6px", background: "var(--component-node-widget-background)",
+                        border: "1px solid var(--component-node-border)", color: "var(--input-text)", fontSize: "var(--comfy-textarea-font-size)"
+                    });
+                    btn.onclick = () => showFrame(this, step);
+                    return btn;
+                };
+                this.framePrevBtn = makeFrameBtn("◀", "left", -1);
+                this.frameNextBtn = makeFrameBtn("▶", "right", 1);
+
+                infoBar.appendChild(this.framePrevBtn);
                 infoBar.appendChild(dimsLabel);
+                infoBar.appendChild(this.frameNextBtn);
                 this.infoBar = infoBar;
                 previewContainer.appendChild(infoBar);
 
@@ -381,9 +564,9 @@ app.registerExtension({
 
                         // 3. Automatically Lock/Unlock to JSON based on Pin state
                         if (this.isPinned && hasRef) {
-                            this.properties["imgnr_locked_ref_data"] = this.persistedRefData;
-                        } else {
-                            delete this.properties["imgnr_locked_ref_data"];
+                            lockRefData(this);
+                        } else if (this.properties["imgnr_locked_ref_data"]) {
+                            unlockRefData(this);
                         }
 
                         if (this.isPinned) {
@@ -534,14 +717,25 @@ app.registerExtension({
 
                     const updateUIState = () => {
                         const autosave = this.widgets.find(w => w.name === "autosave")?.value;
-                        if (this.savedFilename) {
+                        if (this.saveStatus === "queued") {
+                            statusLabel.style.color = "var(--input-text)";
+                            statusLabel.title = "";
+                            statusLabel.textContent = "SAVING IN BACKGROUND...";
+                        } else if (this.saveStatus === "error" && this.saveError) {
+                            statusLabel.innerHTML = `SAVE FAILED:<br><span style="font-weight:normal; font-size:9px;">${this.saveError}</span>`;
+                            statusLabel.style.color = "#b24747";
+                            statusLabel.title = this.saveError;
+                        } else if (this.savedFilename) {
                             let prefix = "SAVED:";
                             if (this.saveStatus === "overwritten") prefix = "File Exists, SAVED OVER:";
                             else if (this.saveStatus === "saved_as") prefix = "File Exists, SAVED AS:";
+                            else if (this.saveStatus === "duplicate") prefix = "Unchanged, ALREADY SAVED:";
 
-                            statusLabel.innerHTML = `${prefix}<br><span style="font-weight:normal; font-size:9px;">${this.savedFilename}</span>`;
+                            const stats = formatSaveStats(this.saveStats);
+                            const statsLine = stats ? `<br><span style="font-weight:normal; font-size:9px; opacity:0.7;">${stats}</span>` : "";
+                            statusLabel.innerHTML = `${prefix}<br><span style="font-weight:normal; font-size:9px;">${this.savedFilename}</span>${statsLine}`;
                             statusLabel.style.color = "var(--input-text)"; 
-                            statusLabel.title = this.savedFilename; 
+                            statusLabel.title = stats ? `${this.savedFilename}\n${stats}` : this.savedFilename; 
                         } else {
                             statusLabel.style.color = "var(--input-text)"; 
                             statusLabel.title = "";
@@ -587,18 +781,28 @@ app.registerExtension({
                             add_counter: getVal("add_counter"),
                             filename_extras: getVal("filename_extras"),
                             overwrite: getVal("overwrite"),
-                            embed_workflow: getVal("embed_workflow")
+                            embed_workflow: getVal("embed_workflow"),
+                            metadata_mode: getVal("metadata_mode"),
+                            skip_duplicates: getVal("skip_duplicates")
                         };
                         
                         try {
-                            const resp = await api.fetchApi("/imgnr/save_manual", { method: "POST", body: JSON.stringify(payload) });
-                            const result = await resp.json();
+                            // Server saves a few images at a time; when it answers "busy", wait and retry
+                            let result;
+                            for (let attempt = 0; attempt < 20; attempt++) {
+                                const resp = await api.fetchApi("/imgnr/save_manual", { method: "POST", body: JSON.stringify(payload) });
+                                result = await resp.json();
+                                if (!result.busy) break;
+                                saveBtn.textContent = "Queued...";
+                                await new Promise(r => setTimeout(r, Math.min(250 * (attempt + 1), 2000)));
+                            }
                             if (result.success) {
                                 saveBtn.textContent = "Saved!";
                                 const cntWidget = this.widgets.find(w => w.name === "counter");
                                 if (cntWidget) cntWidget.value = result.new_counter;
                                 this.savedFilename = result.relative_path;
                                 this.saveStatus = result.save_status;
+                                this.saveStats = null;
                                 updateUIState();
                             } else {
                                 alert("Save Failed: " + result.message); saveBtn.textContent = "Error";
@@ -651,6 +855,9 @@ app.registerExtension({
             const onRemoved = nodeType.prototype.onRemoved;
             nodeType.prototype.onRemoved = function () {
                 onRemoved?.apply(this, arguments);
+                // Release the server side pin; the property stays so undo / tab switching can pin it again on configure
+                const hash = this.properties?.imgnr_locked_ref_data?.ref_hash;
+                if (hash) pinRef(this.id, hash, false).catch(() => {});
             };
 
             // --- 6. CONFIGURE (RELOAD FROM TABS OR JSON) ---
@@ -666,6 +873,8 @@ app.registerExtension({
                 // 2. Restore locked Reference Image (Only if it was pinned)
                 if (this.properties?.imgnr_locked_ref_data) {
                     this.persistedRefData = this.properties.imgnr_locked_ref_data;
+                    const hash = this.properties.imgnr_locked_ref_data.ref_hash;
+                    if (hash) pinRef(this.id, hash, true).catch(() => {});
                 }
 
                 // 3. Restore slider value
@@ -699,18 +908,34 @@ app.registerExtension({
                 const container = this.previewContainerElement;
                 if (!container) return;
 
+                this.stagedPreview = null;
                 if (message?.imgnr_b64_previews?.length) {
                     const info = message.imgnr_b64_previews[0];
                     if (info.image) {
+                        // Progressive preview: the full image may already be there
+                        const full = earlyFullPreviews.get(info.image);
+                        if (full) earlyFullPreviews.delete(info.image);
                         const newPayload = {
-                            uri: info.image,
+                            uri: (full && full.image) || info.image,
+                            ref_hash: (full && full.ref_hash) || info.ref_hash || null,
                             width: info.width || 0,
                             height: info.height || 0,
                             params: info.params || {},
                             current_counter: info.current_counter,
-                            meta: info.meta 
+                            meta: info.meta,
+                            metrics: info.metrics || null,
+                            grid: info.grid || null,
+                            previewError: (full && full.error) || null
                         };
 
+                        // List mode: every preview entry is one batch frame
+                        if (message.imgnr_b64_previews.length > 1) {
+                            newPayload.frames = message.imgnr_b64_previews
+                                .filter(p => p.image)
+                                .map(p => ({ uri: p.image, width: p.width || 0, height: p.height || 0, batch_index: p.batch_index }));
+                            newPayload.frameIndex = 0;
+                        }
+
                         // Comparison specific logic
                         if (hasCompareControls) {
                             if (!this.isPinned && this.persistedImageData) {
@@ -718,8 +943,8 @@ app.registerExtension({
                             }
                             
                             // Immediately sync to JSON if we are pinned
-                            if (this.isPinned && this.persistedRefData) {
-                                this.properties["imgnr_locked_ref_data"] = this.persistedRefData;
+                            if (this.isPinned && this.persistedRefData && !this.properties["imgnr_locked_ref_data"]) {
+                                lockRefData(this);
                             }
                         } else {
                             this.persistedRefData = null;
@@ -744,6 +969,20 @@ app.registerExtension({
                             }
                             this.savedFilename = info.saved_filename || null;
                             this.saveStatus = info.save_status || null;
+                            this.saveError = null;
+                            this.saveStats = info.save_stats || null;
+                            this.pendingSaveId = info.save_id ?? null;
+
+                            // Background save may already be done
+                            const early = this.pendingSaveId !== null ? earlySaveStatus.get(this.pendingSaveId) : null;
+                            if (early) {
+                                earlySaveStatus.delete(this.pendingSaveId);
+                                this.pendingSaveId = null;
+                                this.savedFilename = early.success ? early.saved_filename : null;
+                                this.saveStatus = early.save_status;
+                                this.saveError = early.success ? null : early.message;
+                                this.saveStats = early.save_stats || null;
+                            }
                             if (this.updateUIState) this.updateUIState();
                         }
                     }
@@ -753,6 +992,30 @@ app.registerExtension({
                 setNodeSizeToImage(this);
             };
 
+            // --- 7b. PROGRESSIVE PREVIEW ---
+            nodeType.prototype.showThumbnail = function (detail) {
+                if (!this.previewContainerElement) return;
+                this.stagedPreview = { uri: detail.image, width: detail.width || 0, height: detail.height || 0 };
+                ensureImageExists(this);
+            };
+
+            // Swap the thumbnail for the full preview wherever it is shown (it may have become the reference already)
+            nodeType.prototype.applyFullPreview = function (detail) {
+                let applied = false;
+                for (const data of [this.persistedImageData, this.persistedRefData]) {
+                    if (!data || data.uri !== detail.thumb) continue;
+                    if (detail.error) {
+                        data.previewError = detail.error;
+                    } else {
+                        data.uri = detail.image;
+                        if (detail.ref_hash) data.ref_hash = detail.ref_hash;
+                    }
+                    applied = true;
+                }
+                if (applied) ensureImageExists(this);
+                return applied;
+            };
+
             // --- 8. HANDLE BYPASS/MUTE STATE VISUALS ---
             const onDrawBackground = nodeType.prototype.onDrawBackground;
             nodeType.prototype.onDrawBackground = function (ctx) {
@@ -6,6 +6,7 @@
 // FIXED: Bulletproof Active/Bookmarked Extraction (checks title, type, settings API, and localStorage)
 // DIAGNOSTIC: Added verbose console logs for array extraction
 // NEW: Added bonus + marker for bookmarked or already present nodes
+// NEW: Shows the node index warm-up progress while the background scan runs
 
 import { app } from "../../scripts/app.js";
 import { api } from "../../scripts/api.js";
@@ -157,6 +158,11 @@ app.registerExtension({
             const item = document.createElement("div");
             item.className = "litemenu-entry umhanft-item";
             item.innerText = `🔍 UMightHaveANodeForThat (${data.count})`;
+            if (data.warming_up && data.count === 0) {
+                // Background scan of the installed nodes hasn't finished yet
+                const progress = data.status?.progress;
+                item.innerText = progress?.total ? `🔍 UMightHaveANodeForThat (indexing ${progress.done}/${progress.total}...)` : "🔍 UMightHaveANodeForThat (indexing...)";
+            }
             item.style.cursor = "pointer";
             item.addEventListener("click", (e) => {
                 // Inline SVG matching the solid bookmark UI icon
@@ -10,108 +10,1269 @@
 # Updated: Renamed Preview Ad-hoc Save - LastGen Compare (IMGNR)
 # FINAL: Split into 3 distinct nodes (No Save, Ad-Hoc Save, Compare)
 # FIXED: Workflow not embedded when triggering ad-hoc manual save outside execution loop
+# NEW: Batch previews (List / Grid) encoded in parallel on a bounded thread pool
+# NEW: Previews served from an in-memory content-addressed store (short URL instead of inline base64)
+# NEW: Preview codec settings (PNG/JPEG/WebP, max size, quality), saving stays lossless full resolution
+# NEW: Optional background writer for autosave (bounded queue, status pushed to the node UI)
+# OPTIMIZED: Saving encodes once; already encoded PNGs get their metadata chunks spliced in (no re-encode)
+# OPTIMIZED: tensor_to_pil scales/clamps/casts on the tensor's device, only the uint8 frame is copied to host
+# OPTIMIZED: Workflow cache is a size-capped LRU that stores identical workflows once (content hash)
+# OPTIMIZED: Compare node gets a server-side metadata diff (changed inputs + hash) instead of the full prompt
+# OPTIMIZED: Single-pass NaN-safe JSON serialization (replaces recursive clean_json)
+# OPTIMIZED: Filename prefixes compiled once into templates; node lookup maps cached per workflow
+# OPTIMIZED: Per-folder filename index (mtime revalidated) replaces directory listing + exists() probing per save
+# NEW: Atomic filename reservation (index lock + exclusive create) for concurrent saves sharing a prefix
+# NEW: Batch autosave (every image, %batch_index% filenames) encoded on a CPU-sized thread pool, throughput shown in the node
+# OPTIMIZED: Last rendered frames retained per node (bounded LRU), SAVE NOW only posts the node id + preview url
+# OPTIMIZED: Manual saves run on a bounded executor off the event loop (busy response when saturated)
+# NEW: On-disk reference store for the Compare node (pins + last generations); workflows only keep the hash
+# OPTIMIZED: In-memory stores share one size-capped LRU helper and one per-execution memo, lower default caps
+# FIXED: Reference store pins count against its byte budget (least recently pinned dropped after ring entries)
+# NEW: Compare node outputs a diff heatmap + PSNR / MAE / SSIM against the previous run or pinned reference (batched torch ops)
+# OPTIMIZED: Workflow metadata serialized once per workflow; embedded, compressed (zTXt/iTXt) or as sidecar JSON
+# OPTIMIZED: Frame fingerprints: unchanged frames reuse their encoded preview, optional skip of duplicate saves
+# NEW: Progressive previews: large frames show a thumbnail first, the full preview is encoded in the background
 
 import os
 import re
 from datetime import datetime
 import torch
-import numpy as np
-from PIL import Image
-from PIL.PngImagePlugin import PngInfo
+from PIL import Image, PngImagePlugin
 import base64
 import io
 import json
 import math
 import sys
+import time
+import asyncio
+import concurrent.futures
+import hashlib
+import threading
+import queue
+import atexit
+import struct
+import zlib
+import functools
+import weakref
+from collections import OrderedDict
 from server import PromptServer
 from aiohttp import web
 import folder_paths
 from . import IMGNR_constants as C
 
+# --- UTILITY: NaN-SAFE JSON ---
+# json.dumps runs in C. Only when the data really holds NaN/Infinity (allow_nan=False raises), the emitted
+# tokens are swapped for null. Tokens inside strings (e.g. "NaN" in a text prompt) are skipped by tracking
+# unescaped quotes between matches, so the fix-up also stays in C-level string operations (find/count).
+def find_non_finite_tokens(text):
+    spans = []
+    for token in ("NaN", "Infinity"):
+        pos = text.find(token)
+        while pos != -1:
+            start = pos - 1 if token == "Infinity" and pos > 0 and text[pos - 1] == "-" else pos
+            spans.append((start, pos + len(token)))
+            pos = text.find(token, pos + len(token))
+    return sorted(spans)
+
+def json_dumps_safe(obj, **kwargs):
+    try:
+        return json.dumps(obj, allow_nan=False, **kwargs)
+    except ValueError:
+        text = json.dumps(obj, **kwargs)
+
+    parts, copied, scanned, in_string = [], 0, 0, False
+    for start, end in find_non_finite_tokens(text):
+        segment = text[scanned:start].replace("\\\\", "")
+        if (segment.count('"') - segment.count('\\"')) % 2:
+            in_string = not in_string
+        scanned = start
+        if not in_string:
+            parts.append(text[copied:start])
+            parts.append("null")
+            copied = end
+    parts.append(text[copied:])
+    return "".join(parts)
+
+# --- UTILITY: SIZE-CAPPED LRU ---
+# key -> (value, size), least recently used evicted first once the sizes add up to more than max_bytes.
+# The entry just stored always stays. Not locked: the stores below guard it with their own lock.
+# Default RAM caps: preview store + encode cache 128 MB each, frame retention + compare history 256 MB each,
+# workflow cache 64 MB (832 MB at most). GET /imgnr/cache_stats shows what they actually hold.
+class IMGNR_ByteLRU:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, touch=True):
+        entry = self.entries.get(key)
+        if entry is None: return None
+        if touch: self.entries.move_to_end(key)
+        return entry[0]
+
+    def pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None: return None
+        self.total_bytes -= entry[1]
+        return entry[0]
+
+    def put(self, key, value, size):
+        self.pop(key)
+        self.entries[key] = (value, size)
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            _, (_, old_size) = self.entries.popitem(last=False)
+            self.total_bytes -= old_size
+
+    def stats(self):
+        return {"entries": len(self.entries), "bytes": self.total_bytes, "max_bytes": self.max_bytes}
+
 # --- GLOBAL CACHE FOR MANUAL SAVES ---
 # Maps node_id -> {"prompt": prompt, "extra_pnginfo": extra_pnginfo}
-IMGNR_WORKFLOW_CACHE = {}
+# Size-capped LRU by node id. Prompts/workflows are stored once per content hash and shared
+# between nodes (and between runs of the same workflow), sized by their serialized length.
+# Hashes and sizes come from IMGNR_METADATA_CACHE, so the JSON serialized here is what autosave embeds.
+WORKFLOW_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+class IMGNR_WorkflowCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nodes = OrderedDict() # node_id -> (prompt_key, extra_key)
+        self.blobs = {}            # content hash -> [obj, size, refcount]
+        self.total_bytes = 0
+        self.hits = self.misses = self.evictions = self.dedup_hits = 0
+        self.lock = threading.Lock()
+
+    def _intern(self, obj, part):
+        # part: (content hash, serialized size) of obj
+        if obj is None: return None
+        key, size = part
+        blob = self.blobs.get(key)
+        if blob is not None:
+            self.dedup_hits += 1
+        else:
+            blob = self.blobs[key] = [obj, size, 0]
+            self.total_bytes += size
+        blob[2] += 1
+        return key
+
+    def _release(self, key):
+        if key is None: return
+        blob = self.blobs[key]
+        blob[2] -= 1
+        if blob[2] <= 0:
+            del self.blobs[key]
+            self.total_bytes -= blob[1]
+
+    def put(self, node_id, prompt, extra_pnginfo):
+        prompt_part, extra_part = IMGNR_METADATA_CACHE.serialize(prompt, extra_pnginfo)[2]
+        with self.lock:
+            keys = (self._intern(prompt, prompt_part), self._intern(extra_pnginfo, extra_part))
+            old_keys = self.nodes.pop(node_id, None)
+            self.nodes[node_id] = keys
+            if old_keys:
+                for key in old_keys: self._release(key)
+            # Evict least recently used nodes, but always keep the one just stored
+            while self.total_bytes > self.max_bytes and len(self.nodes) > 1:
+                _, evicted = self.nodes.popitem(last=False)
+                for key in evicted: self._release(key)
+                self.evictions += 1
+
+    def get(self, node_id):
+        with self.lock:
+            keys = self.nodes.get(node_id)
+            if keys is None:
+                self.misses += 1
+                return {}
+            self.hits += 1
+            self.nodes.move_to_end(node_id)
+            prompt_key, extra_key = keys
+            return {
+                "prompt": self.blobs[prompt_key][0] if prompt_key else None,
+                "extra_pnginfo": self.blobs[extra_key][0] if extra_key else None
+            }
+
+    def stats(self):
+        with self.lock:
+            return {
+                "nodes": len(self.nodes), "unique_entries": len(self.blobs),
+                "bytes": self.total_bytes, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "dedup_hits": self.dedup_hits
+            }
+
+IMGNR_WORKFLOW_CACHE = IMGNR_WorkflowCache(WORKFLOW_CACHE_MAX_BYTES)
+
+# --- METADATA HISTORY (Compare LastGen diff) ---
+# Keeps a flattened snapshot {(node_id, input): value} of recent prompts by hash, plus the last hash per node,
+# so the Compare node only receives the changed inputs and a hash to detect when it is out of sync.
+META_HISTORY_SIZE = 64
+
+def json_safe_value(value):
+    # NaN/Inf are not valid JSON for the frontend
+    if isinstance(value, float) and (math.isnan(value) or math.isinf(value)):
+        return None
+    return value
+
+class IMGNR_MetaHistory:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.snapshots = OrderedDict() # hash -> {"values": {(node_id, input): value}, "classes": {node_id: class_type}}
+        self.last_hash = {}            # compare node_id -> hash of its previous generation
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def flatten(prompt):
+        values, classes = {}, {}
+        for node_id, node_data in prompt.items():
+            classes[node_id] = node_data.get("class_type", "")
+            for name, value in node_data.get("inputs", {}).items():
+                # Links ([node_id, slot]) and structures are not compared, same as the previous JS diff
+                if value is not None and not isinstance(value, (list, dict)):
+                    values[(node_id, name)] = value
+        return {"values": values, "classes": classes}
+
+    @staticmethod
+    def snapshot_hash(snapshot):
+        data = json.dumps(sorted((f"{k[0]}.{k[1]}", repr(v)) for k, v in snapshot["values"].items()))
+        return hashlib.blake2b(data.encode("utf-8"), digest_size=12).hexdigest()
+
+    @staticmethod
+    def diff(current, reference):
+        changes = []
+        ref_values = reference["values"]
+        for key, new in current["values"].items():
+            if key not in ref_values: continue
+            old = ref_values[key]
+            if old == new or (old != old and new != new): continue # NaN == NaN for diffing
+            changes.append({"node": key[0], "class_type": current["classes"].get(key[0], ""), "input": key[1], "old": json_safe_value(old), "new": json_safe_value(new)})
+        return changes
+
+    def record(self, node_id, prompt):
+        snapshot = self.flatten(prompt)
+        digest = self.snapshot_hash(snapshot)
+        with self.lock:
+            prev_hash = self.last_hash.get(node_id)
+            prev = self.snapshots.get(prev_hash) if prev_hash else None
+            self.snapshots[digest] = snapshot
+            self.snapshots.move_to_end(digest)
+            while len(self.snapshots) > self.max_entries:
+                self.snapshots.popitem(last=False)
+            self.last_hash[node_id] = digest
+        return {
+            "hash": digest,
+            "prev_hash": prev_hash if prev is not None else None,
+            "diff": self.diff(snapshot, prev) if prev is not None else []
+        }
+
+    def diff_hashes(self, current_hash, reference_hash):
+        # Returns None when either snapshot is no longer known (e.g. after a restart)
+        with self.lock:
+            current = self.snapshots.get(current_hash)
+            reference = self.snapshots.get(reference_hash)
+            if current is None or reference is None: return None
+            self.snapshots.move_to_end(current_hash)
+            self.snapshots.move_to_end(reference_hash)
+        return self.diff(current, reference)
+
+IMGNR_META_HISTORY = IMGNR_MetaHistory(META_HISTORY_SIZE)
+
+# --- BATCH PREVIEW ENCODER POOL ---
+# PIL releases the GIL while compressing, so a small thread pool encodes batch frames in parallel.
+BATCH_PREVIEW_MODES = ["First Image", "All Images (List)", "All Images (Grid)"]
+IMGNR_ENCODE_WORKERS = max(1, min(8, os.cpu_count() or 1))
+IMGNR_ENCODE_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=IMGNR_ENCODE_WORKERS, thread_name_prefix="IMGNR_Encode")
+
+# --- PREVIEW STORE (Content-addressed, RAM only) ---
+# Encoded previews are kept in server memory (never written to disk) and served by hash,
+# so the websocket message and the browser only carry a short URL instead of a base64 blob.
+PREVIEW_STORE_MAX_BYTES = 128 * 1024 * 1024
+PREVIEW_URL_PREFIX = "/imgnr/preview/"
+PREVIEW_EXTENSIONS = {"image/png": "png", "image/jpeg": "jpg", "image/webp": "webp"}
+
+class IMGNR_PreviewStore:
+    def __init__(self, max_bytes):
+        self.entries = IMGNR_ByteLRU(max_bytes) # digest -> (bytes, mime)
+        self.lock = threading.Lock()
+
+    def put(self, data, mime="image/png"):
+        digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+        with self.lock:
+            if self.entries.get(digest) is None:
+                self.entries.put(digest, (data, mime), len(data))
+        return f"{PREVIEW_URL_PREFIX}{digest}.{PREVIEW_EXTENSIONS.get(mime, 'png')}"
+
+    def get(self, digest):
+        with self.lock:
+            return self.entries.get(digest)
+
+    def stats(self):
+        with self.lock:
+            return self.entries.stats()
+
+    def get_by_url(self, url):
+        # Accepts "/imgnr/preview/<digest>.<ext>", optionally prefixed (e.g. "/api") or with a query string
+        if not isinstance(url, str) or PREVIEW_URL_PREFIX not in url:
+            return None
+        name = url.split(PREVIEW_URL_PREFIX, 1)[1].split("?", 1)[0]
+        return self.get(name.split(".", 1)[0])
+
+IMGNR_PREVIEW_STORE = IMGNR_PreviewStore(PREVIEW_STORE_MAX_BYTES)
+
+# --- PREVIEW CODEC ---
+PREVIEW_FORMATS = ["PNG", "JPEG", "WEBP"]
+
+def preview_size(width, height, preview_max_size=0):
+    if preview_max_size and max(width, height) > preview_max_size:
+        scale = preview_max_size / max(width, height)
+        return max(1, round(width * scale)), max(1, round(height * scale))
+    return width, height
+
+# --- PROGRESSIVE PREVIEW ---
+# A large frame is first pushed as a small thumbnail (downscaled on the tensor's device, "imgnr-preview-thumb"),
+# the full preview is encoded on the encode pool and announced with "imgnr-preview-full" when it is ready.
+# The node returns without waiting for it (unless it has to save the frame itself).
+PROGRESSIVE_MIN_EDGE = 2048 # Smaller previews are encoded directly
+PROGRESSIVE_THUMB_EDGE = 512
+PROGRESSIVE_THUMB_QUALITY = 80
+
+# --- ENCODED FRAME CACHE (content fingerprints) ---
+# Re-queued prompts hand the preview nodes identical images (often the very same cached tensor).
+# Frames are fingerprinted (blake2b of the uint8 pixels, ~30x cheaper than a PNG encode) and an unchanged
+# frame reuses its encoded preview. The same tensor object (same version, i.e. not modified in place)
+# is recognized without even converting it: weak references, so no tensor is kept alive by the cache.
+# Inference tensors (everything ComfyUI executes under torch.inference_mode) have no version counter, so they
+# always take the pixel digest.
+ENCODE_CACHE_MAX_BYTES = 128 * 1024 * 1024
+ENCODE_CACHE_MAX_TENSORS = 64
+
+def numpy_contiguous(arr):
+    return arr if arr.flags["C_CONTIGUOUS"] else arr.copy(order="C")
+
+class IMGNR_EncodeCache:
+    def __init__(self, max_bytes, max_tensors):
+        self.max_bytes = max_bytes
+        self.max_tensors = max_tensors
+        self.entries = IMGNR_ByteLRU(max_bytes) # (digest, preview opts) -> (pil_img, bytes, mime, lossless)
+        self.tensors = OrderedDict() # (id(tensor), index) -> (weakref, version, digest)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(arr):
+        h = hashlib.blake2b(digest_size=16)
+        h.update(repr(arr.shape).encode())
+        h.update(memoryview(numpy_contiguous(arr)))
+        return h.hexdigest()
+
+    def tensor_digest(self, tensor, index):
+        # Digest recorded for this exact tensor object + index, if it wasn't modified since
+        if tensor.is_inference(): return None
+        with self.lock:
+            entry = self.tensors.get((id(tensor), index))
+        if entry is None: return None
+        ref, version, digest = entry
+        return digest if ref() is tensor and tensor._version == version else None
+
+    def remember_tensor(self, tensor, index, digest):
+        if tensor.is_inference(): return # No version counter: in-place changes can't be detected
+        try:
+            ref = weakref.ref(tensor)
+        except TypeError:
+            return
+        with self.lock:
+            key = (id(tensor), index)
+            self.tensors[key] = (ref, tensor._version, digest)
+            self.tensors.move_to_end(key)
+            while len(self.tensors) > self.max_tensors:
+                self.tensors.popitem(last=False)
+
+    def get(self, digest, opts_key):
+        with self.lock:
+            result = self.entries.get((digest, opts_key))
+            if result is None: self.misses += 1
+            else: self.hits += 1
+            return result
+
+    def put(self, digest, opts_key, result):
+        pil_img, data = result[0], result[1]
+        size = len(data) + pil_img.width * pil_img.height * len(pil_img.getbands())
+        with self.lock:
+            key = (digest, opts_key)
+            if key in self.entries or size > self.max_bytes: return
+            self.entries.put(key, result, size)
+
+    def stats(self):
+        with self.lock:
+            return {**self.entries.stats(), "tensors": len(self.tensors), "hits": self.hits, "misses": self.misses}
+
+IMGNR_ENCODE_CACHE = IMGNR_EncodeCache(ENCODE_CACHE_MAX_BYTES, ENCODE_CACHE_MAX_TENSORS)
+
+# --- LAST RENDERED FRAMES (per node, RAM only) ---
+# What SAVE NOW writes, so the browser only has to send the node id (and which preview it shows).
+# Lossless previews keep their PNG bytes (written as-is, shared with the preview store), lossy/downscaled
+# previews keep the full resolution PIL image. Last execution per node, least recently used node evicted first.
+FRAME_RETENTION_MAX_BYTES = 256 * 1024 * 1024
+
+class IMGNR_FrameRetention:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = IMGNR_ByteLRU(max_bytes) # node_id -> (frames {preview_url: bytes | PIL.Image}, first_url)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def frame_size(frame):
+        if isinstance(frame, concurrent.futures.Future):
+            return 0 # Still encoding (progressive preview), sized once update() swaps in the result
+        if isinstance(frame, (bytes, bytearray)):
+            return len(frame)
+        return frame.width * frame.height * len(frame.getbands())
+
+    def frames_size(self, frames):
+        # Several urls may share one frame (thumbnail + full preview)
+        return sum(self.frame_size(f) for f in {id(f): f for f in frames.values()}.values())
+
+    def put(self, node_id, frames, first_url):
+        size = self.frames_size(frames)
+        with self.lock:
+            self.entries.pop(node_id)
+            if size > self.max_bytes:
+                return # Too big to keep: SAVE NOW falls back to the preview store / uploaded image
+            self.entries.put(node_id, (frames, first_url), size)
+
+    def update(self, node_id, first_url, frames):
+        # Frames that finished after put() (progressive preview), unless the node has executed again since
+        with self.lock:
+            entry = self.entries.get(node_id, touch=False)
+            if entry is None or entry[1] != first_url:
+                return
+            merged = {**entry[0], **frames}
+            size = self.frames_size(merged)
+            self.entries.pop(node_id)
+            if size <= self.max_bytes:
+                self.entries.put(node_id, (merged, first_url), size)
+
+    def get(self, node_id, url=None):
+        # url: the preview the node shows (None = first frame of the last execution)
+        with self.lock:
+            entry = self.entries.get(node_id)
+            frame = None
+            if entry is not None:
+                frame = entry[0].get(url if url else entry[1])
+            if frame is None: self.misses += 1
+            else: self.hits += 1
+            return frame
+
+    def stats(self):
+        with self.lock:
+            return {"nodes": len(self.entries), "bytes": self.entries.total_bytes, "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses}
+
+IMGNR_FRAME_RETENTION = IMGNR_FrameRetention(FRAME_RETENTION_MAX_BYTES)
+
+# --- REFERENCE STORE (Compare node, on disk) ---
+# Hash-addressed image files in the user folder (same digests as the preview store) + a small index.json.
+# Pinned references and a ring of the last generations per Compare node survive restarts, so the workflow
+# only needs to hold the hash instead of an inlined data URI. Files no pin or ring refers to are deleted.
+# Over the byte budget the oldest ring entries (least recently used node first) go, then the least recently pinned.
+REF_STORE_DIR = os.path.join(folder_paths.get_user_directory(), "IMGNR_Utils", "references")
+REF_RING_SIZE = 8
+REF_RING_MAX_NODES = 64
+REF_STORE_MAX_BYTES = 1024 * 1024 * 1024
+
+class IMGNR_RefStore:
+    def __init__(self, root, ring_size, max_nodes, max_bytes):
+        self.root = root
+        self.index_path = os.path.join(root, "index.json")
+        self.ring_size = ring_size
+        self.max_nodes = max_nodes
+        self.max_bytes = max_bytes
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.images = {} # hash -> {"ext", "mime", "size", "created"}
+        self.total_bytes = 0
+        self.pins = {} # hash -> [node ids]
+        self.rings = OrderedDict() # node id -> [hash, ...] (newest last)
+        # Single writer thread: ring updates are disk writes we don't want on the execution thread
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="IMGNR_RefStore")
+
+    def load(self):
+        # Caller holds self.lock. Lazy, so importing the pack never touches the disk.
+        if self.loaded: return
+        self.loaded = True
+        if not os.path.exists(self.index_path): return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            self.images = index.get("images", {})
+            self.pins = index.get("pins", {})
+            self.rings = OrderedDict(index.get("rings", {}))
+            self.total_bytes = sum(e["size"] for e in self.images.values())
+        except Exception as e:
+            print(f"{C.WARN_PREFIX} [IMGNR_RefStore] Could not read {self.index_path}, starting empty: {e}")
+
+    def save_index(self):
+        # Caller holds self.lock
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"images": self.images, "pins": self.pins, "rings": self.rings}, f)
+        os.replace(tmp_path, self.index_path)
+
+    def file_path(self, ref_hash):
+        return os.path.join(self.root, f"{ref_hash}.{self.images[ref_hash]['ext']}")
+
+    @staticmethod
+    def valid_hash(ref_hash):
+        return isinstance(ref_hash, str) and len(ref_hash) == 32 and all(c in "0123456789abcdef" for c in ref_hash)
+
+    def write_tmp(self, ref_hash, data, mime):
+        # Without the lock: the (full resolution) image write must not block readers, put() only renames it
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = os.path.join(self.root, f"{ref_hash}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        return tmp_path
+
+    def put(self, ref_hash, tmp_path, mime, size):
+        # Caller holds self.lock
+        if ref_hash in self.images:
+            os.remove(tmp_path)
+            return
+        ext = PREVIEW_EXTENSIONS.get(mime, "png")
+        os.replace(tmp_path, os.path.join(self.root, f"{ref_hash}.{ext}"))
+        self.images[ref_hash] = {"ext": ext, "mime": mime, "size": size, "created": time.time()}
+        self.total_bytes += size
+
+    def collect(self):
+        # Caller holds self.lock: drop files nothing refers to any more
+        used = set(self.pins)
+        for ring in self.rings.values():
+            used.update(ring)
+        for ref_hash in [h for h in self.images if h not in used]:
+            self.remove_file(ref_hash)
+
+    def remove_file(self, ref_hash):
+        # Caller holds self.lock
+        try:
+            os.remove(self.file_path(ref_hash))
+        except OSError:
+            pass
+        self.total_bytes -= self.images.pop(ref_hash)["size"]
+
+    def trim(self):
+        # Caller holds self.lock: node count, then the byte budget. Ring entries go first (oldest node first),
+        # then pins (least recently pinned first); the newest generation and the newest pin always stay.
+        while len(self.rings) > self.max_nodes:
+            self.rings.popitem(last=False)
+        self.collect()
+        while self.total_bytes > self.max_bytes:
+            node_id, ring = next(iter(self.rings.items()), (None, []))
+            if len(self.rings) > 1 or len(ring) > 1:
+                ring.pop(0)
+                if not ring:
+                    del self.rings[node_id]
+            elif len(self.pins) > 1:
+                ref_hash = next(iter(self.pins))
+                print(f"{C.WARN_PREFIX} [IMGNR_RefStore] Store over {self.max_bytes // (1024 * 1024)} MB, dropping the oldest pinned reference {ref_hash}")
+                del self.pins[ref_hash]
+            else:
+                break
+            self.collect()
+
+    def record(self, node_id, ref_hash, data, mime):
+        # Last generations of a Compare node (written on the store thread)
+        def job():
+            try:
+                tmp_path = self.write_tmp(ref_hash, data, mime)
+                with self.lock:
+                    self.load()
+                    self.put(ref_hash, tmp_path, mime, len(data))
+                    ring = [h for h in self.rings.pop(node_id, []) if h != ref_hash]
+                    ring.append(ref_hash)
+                    self.rings[node_id] = ring[-self.ring_size:]
+                    self.trim()
+                    self.save_index()
+            except Exception as e:
+                print(f"{C.ERR_PREFIX} [IMGNR_RefStore] Error: {e}")
+        self.pool.submit(job)
+
+    def pin(self, ref_hash, node_id, data=None, mime="image/png"):
+        # Returns the stored entry, or None if the image is neither on disk nor handed in
+        self.pool.submit(lambda: None).result() # let queued ring writes land first
+        tmp_path = self.write_tmp(ref_hash, data, mime) if data is not None else None
+        with self.lock:
+            self.load()
+            if ref_hash not in self.images:
+                if tmp_path is None: return None
+                self.put(ref_hash, tmp_path, mime, len(data))
+            elif tmp_path is not None:
+                os.remove(tmp_path)
+            # Re-pinning moves it to the back, pins are dropped in pin order when over budget
+            nodes = self.pins.pop(ref_hash, [])
+            if node_id not in nodes:
+                nodes.append(node_id)
+            self.pins[ref_hash] = nodes
+            self.trim()
+            self.save_index()
+            return dict(self.images[ref_hash], hash=ref_hash)
+
+    def unpin(self, ref_hash, node_id):
+        # The image moves to the front of the node's ring instead of being deleted, so a node that is only
+        # removed for a moment (tab switch, undo) can pin it again; the next runs or the byte budget drop it.
+        with self.lock:
+            self.load()
+            nodes = self.pins.get(ref_hash)
+            if nodes is None: return
+            if node_id in nodes:
+                nodes.remove(node_id)
+            if not nodes:
+                del self.pins[ref_hash]
+                ring = self.rings.setdefault(node_id, [])
+                if ref_hash not in ring:
+                    ring.insert(0, ref_hash)
+                    del ring[:-self.ring_size]
+            self.trim()
+            self.save_index()
+
+    def get(self, ref_hash):
+        # -> (bytes, mime) or None
+        with self.lock:
+            self.load()
+            entry = self.images.get(ref_hash)
+            if entry is None: return None
+            path = self.file_path(ref_hash)
+        try:
+            with open(path, "rb") as f:
+                return f.read(), entry["mime"]
+        except OSError:
+            return None
+
+    def list(self, node_id=None):
+        # Newest first; node_id limits it to that node's ring + pins
+        with self.lock:
+            self.load()
+            if node_id is None:
+                hashes = list(self.images)
+            else:
+                hashes = [h for h, nodes in self.pins.items() if node_id in nodes]
+                hashes += [h for h in reversed(self.rings.get(node_id, [])) if h not in hashes]
+            return sorted(
+                (dict(self.images[h], hash=h, pinned=h in self.pins, url=f"/imgnr/ref/{h}.{self.images[h]['ext']}") for h in hashes if h in self.images),
+                key=lambda e: e["created"], reverse=True
+            )
+
+    def evict(self, ref_hash):
+        # Removes an image, pinned or not
+        with self.lock:
+            self.load()
+            self.pins.pop(ref_hash, None)
+            for ring in self.rings.values():
+                if ref_hash in ring:
+                    ring.remove(ref_hash)
+            if ref_hash in self.images:
+                self.remove_file(ref_hash)
+            self.save_index()
+
+    def stats(self):
+        with self.lock:
+            self.load()
+            return {"images": len(self.images), "bytes": self.total_bytes, "max_bytes": self.max_bytes, "pinned": len(self.pins), "nodes": len(self.rings)}
+
+IMGNR_REF_STORE = IMGNR_RefStore(REF_STORE_DIR, REF_RING_SIZE, REF_RING_MAX_NODES, REF_STORE_MAX_BYTES)
+
+# --- COMPARE METRICS (Compare node) ---
+# Per image PSNR / MAE / SSIM and a difference heatmap, computed as whole-batch tensor ops on the image's device.
+COMPARE_AGAINST = ["Off", "Auto", "Previous Run", "Pinned Reference"]
+COMPARE_HISTORY_MAX_BYTES = 256 * 1024 * 1024
+PSNR_MAX = 100.0 # Identical images (MSE = 0) report this instead of infinity
+SSIM_WINDOW = 7
+SSIM_C1 = 0.01 ** 2
+SSIM_C2 = 0.03 ** 2
+SSIM_LUMA = [0.299, 0.587, 0.114]
+# Dark -> purple -> orange -> yellow (inferno-like), interpolated per pixel
+HEATMAP_LUT = [[0.0, 0.0, 0.02], [0.34, 0.06, 0.43], [0.73, 0.21, 0.33], [0.98, 0.55, 0.04], [0.99, 1.0, 0.64]]
+
+class IMGNR_CompareHistory:
+    # Previous run's images per Compare node. The IMAGE tensors themselves are kept (outputs are never
+    # modified in place by ComfyUI), so remembering a run costs no copy.
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = IMGNR_ByteLRU(max_bytes) # node_id -> tensor
+        self.lock = threading.Lock()
+
+    def swap(self, node_id, images):
+        # Stores this run's images and returns the previous ones (or None)
+        size = images.numel() * images.element_size()
+        with self.lock:
+            previous = self.entries.pop(node_id)
+            if size <= self.max_bytes:
+                self.entries.put(node_id, images, size)
+        return previous
+
+IMGNR_COMPARE_HISTORY = IMGNR_CompareHistory(COMPARE_HISTORY_MAX_BYTES)
+
+def pinned_ref_hash(extra_pnginfo, node_id):
+    # The hash this workflow pinned on the node (node property written by the frontend when pinning), or None.
+    # Node ids restart in every workflow, so the queued workflow is the only reliable source.
+    workflow = extra_pnginfo.get("workflow") if isinstance(extra_pnginfo, dict) else None
+    for node in (workflow or {}).get("nodes", []):
+        if str(node.get("id")) == node_id:
+            locked = (node.get("properties") or {}).get("imgnr_locked_ref_data") or {}
+            ref_hash = locked.get("ref_hash")
+            return ref_hash if IMGNR_RefStore.valid_hash(ref_hash) else None
+    return None
+
+def pinned_reference_tensor(ref_hash):
+    entry = IMGNR_REF_STORE.get(ref_hash)
+    if entry is None: return None
+    img = Image.open(io.BytesIO(entry[0])).convert("RGB")
+    return torch.frombuffer(bytearray(img.tobytes()), dtype=torch.uint8).view(1, img.height, img.width, 3)
+
+def box_filter(t, win):
+    # Mean over win x win windows ("valid" region) of (..., H, W): separable sums of shifted slices.
+    # Same result as avg_pool2d(t, win, stride=1), ~3x faster on CPU.
+    height, width = t.shape[-2], t.shape[-1]
+    rows = t[..., :, :width - win + 1].clone()
+    for k in range(1, win):
+        rows += t[..., :, k:width - win + 1 + k]
+    out = rows[..., :height - win + 1, :].clone()
+    for k in range(1, win):
+        out += rows[..., k:height - win + 1 + k, :]
+    return out.div_(win * win)
+
+def compare_metrics(current, reference):
+    # current (B,H,W,C) float 0..1, reference (R,h,w,C') float 0..1 or uint8. Reference image i % R is used
+    # for image i and resized if needed. Returns (heatmap (B,H,W,3), psnr (B), mae (B), ssim (B)).
+    cur = current[..., :3].float()
+    batch, height, width = cur.shape[0], cur.shape[1], cur.shape[2]
+    ref = reference[..., :3].to(cur.device)
+    ref = ref.float().div_(255.) if ref.dtype == torch.uint8 else ref.float()
+    if ref.shape[0] != batch:
+        ref = ref[torch.arange(batch, device=ref.device) % ref.shape[0]]
+    if ref.shape[1:3] != cur.shape[1:3]:
+        ref = torch.nn.functional.interpolate(ref.movedim(-1, 1), size=(height, width), mode="bilinear", align_corners=False).movedim(1, -1)
+
+    diff = cur - ref
+    mae = diff.abs().mean(dim=(1, 2, 3))
+    mse = diff.square().mean(dim=(1, 2, 3))
+    psnr = torch.where(mse > 0, -10.0 * torch.log10(mse.clamp_min(1e-20)), torch.full_like(mse, PSNR_MAX)).clamp_max(PSNR_MAX)
+
+    # SSIM on luma (BT.601, like most tools report) with a uniform window. The five local statistics are
+    # box filtered together as one (B,5,H,W) stack.
+    luma = torch.tensor(SSIM_LUMA, dtype=cur.dtype, device=cur.device)
+    x = cur @ luma
+    y = ref @ luma
+    win = min(SSIM_WINDOW, height, width)
+    stats = box_filter(torch.stack((x, y, x * x, y * y, x * y), dim=1), win)
+    mu_x, mu_y, xx, yy, xy = stats.unbind(dim=1)
+    var_x = xx - mu_x * mu_x
+    var_y = yy - mu_y * mu_y
+    cov = xy - mu_x * mu_y
+    ssim_map = ((2 * mu_x * mu_y + SSIM_C1) * (2 * cov + SSIM_C2)) / ((mu_x * mu_x + mu_y * mu_y + SSIM_C1) * (var_x + var_y + SSIM_C2))
+    ssim = ssim_map.mean(dim=(1, 2))
+
+    # Heatmap: per pixel mean abs difference, normalized to each image's largest difference
+    heat = diff.abs().mean(dim=-1)
+    peak = heat.amax(dim=(1, 2), keepdim=True)
+    heat = torch.where(peak > 0, heat / peak.clamp_min(1e-12), heat)
+    lut = torch.tensor(HEATMAP_LUT, dtype=heat.dtype, device=heat.device)
+    pos = heat * (len(HEATMAP_LUT) - 1)
+    lo = pos.floor().long().clamp_(0, len(HEATMAP_LUT) - 2)
+    frac = (pos - lo).unsqueeze(-1)
+    heatmap = lut[lo] * (1 - frac) + lut[lo + 1] * frac
+    return heatmap, psnr, mae, ssim
+
+
+def select_batch_indices(batch_size, max_previews):
+    # Evenly spread a subset over the batch when it exceeds max_previews (0 = all)
+    if max_previews <= 0 or batch_size <= max_previews:
+        return list(range(batch_size))
+    step = (batch_size - 1) / max(1, max_previews - 1)
+    return sorted({int(round(i * step)) for i in range(max_previews)})
+
+# --- FILENAME TEMPLATES ---
+# Prefixes are parsed once into literal / date / node variable parts (cached per prefix string).
+# The title/class -> node id maps are built once per workflow (cached by object identity),
+# so resolving a prefix costs O(number of tokens) instead of O(workflow size).
+FILENAME_DATE_RE = re.compile(r"%date:(.*?)%")
+FILENAME_VAR_RE = re.compile(r"%([^%]+)%")
+EXECUTION_MEMO_SIZE = 16 # Executions whose derived values are kept (prompts queued back to back)
+
+class IMGNR_FilenameTemplate:
+    def __init__(self, text):
+        self.parts = [] # ("lit", text) | ("date", strftime format, raw) | ("var", node name, widget name, raw)
+        # 1. Date tokens first, 2. node variables in the text between them (same order as before)
+        pos = 0
+        for match in FILENAME_DATE_RE.finditer(text):
+            self.parse_vars(text[pos:match.start()])
+            fmt = match.group(1)
+            fmt = fmt.replace("yyyy", "%Y").replace("yy", "%y")
+            fmt = fmt.replace("MM", "%m").replace("dd", "%d")
+            fmt = fmt.replace("HH", "%H").replace("mm", "%M").replace("ss", "%S")
+            self.parts.append(("date", fmt, match.group(0)))
+            pos = match.end()
+        self.parse_vars(text[pos:])
+        self.has_vars = any(part[0] == "var" for part in self.parts)
+        self.is_literal = all(part[0] == "lit" for part in self.parts)
+        self.text = text
+
+    def parse_vars(self, text):
+        pos = 0
+        for match in FILENAME_VAR_RE.finditer(text):
+            if match.start() > pos:
+                self.parts.append(("lit", text[pos:match.start()]))
+            var_parts = match.group(1).rsplit(".", 1)
+            if len(var_parts) == 2:
+                self.parts.append(("var", var_parts[0], var_parts[1], match.group(0)))
+            else:
+                self.parts.append(("lit", match.group(0)))
+            pos = match.end()
+        if pos < len(text):
+            self.parts.append(("lit", text[pos:]))
+
+    def render(self, prompt=None, extra_pnginfo=None):
+        if self.is_literal:
+            return self.text
+        now = datetime.now()
+        lookup = get_node_lookup(prompt, extra_pnginfo) if (self.has_vars and prompt) else None
+        out = []
+        for part in self.parts:
+            kind = part[0]
+            if kind == "lit":
+                out.append(part[1])
+            elif kind == "date":
+                try:
+                    out.append(now.strftime(part[1]))
+                except Exception:
+                    out.append(part[2])
+            else:
+                out.append(self.resolve_var(part, prompt, lookup) if lookup else part[3])
+        return "".join(out)
+
+    @staticmethod
+    def resolve_var(part, prompt, lookup):
+        _, node_name, widget_name, raw = part
+        title_to_id, class_to_id = lookup
+        target_id = title_to_id.get(node_name) or class_to_id.get(node_name)
+
+        if target_id and target_id in prompt:
+            inputs = prompt[target_id].get("inputs", {})
+            if widget_name in inputs:
+                val = inputs[widget_name]
+                # Handle primitive links implicitly (grabs evaluated values from upstream)
+                if isinstance(val, list) and len(val) == 2: 
+                    link_id = str(val[0])
+                    if link_id in prompt:
+                        for k, v in prompt[link_id].get("inputs", {}).items():
+                            if not isinstance(v, list):
+                                return str(v)
+                return str(val)
+        return raw
+
+compile_filename_template = functools.lru_cache(maxsize=256)(IMGNR_FilenameTemplate)
+
+# --- PER-EXECUTION MEMO ---
+# Values derived from one execution's prompt/extra_pnginfo (node lookup maps, serialized metadata), keyed by
+# identity: ComfyUI hands every node of one execution the very same objects. The objects are kept in the
+# entry, so their ids can't be reused while cached.
+class IMGNR_ExecutionMemo:
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict() # (id(prompt), id(extra_pnginfo)) -> (prompt, extra_pnginfo, {name: value})
+        self.lock = threading.Lock()
+
+    def get(self, prompt, extra_pnginfo, name, build):
+        key = (id(prompt), id(extra_pnginfo))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] is prompt and entry[1] is extra_pnginfo:
+                self.entries.move_to_end(key)
+                if name in entry[2]:
+                    return entry[2][name]
+        value = build(prompt, extra_pnginfo)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] is not prompt or entry[1] is not extra_pnginfo:
+                entry = self.entries[key] = (prompt, extra_pnginfo, {})
+            self.entries.move_to_end(key)
+            entry[2][name] = value
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return value
+
+IMGNR_EXECUTION_MEMO = IMGNR_ExecutionMemo(EXECUTION_MEMO_SIZE)
+
+def build_node_lookup(prompt, extra_pnginfo):
+    title_to_id = {}
+    class_to_id = {}
+    
+    if extra_pnginfo and "workflow" in extra_pnginfo and "nodes" in extra_pnginfo["workflow"]:
+        for node in extra_pnginfo["workflow"]["nodes"]:
+            node_id = str(node.get("id"))
+            title = node.get("title", "")
+            class_type = node.get("type", "")
+            if title: title_to_id[title] = node_id
+            if class_type: class_to_id[class_type] = node_id
+    
+    # Fallback for prompt-only situations
+    for node_id, node_data in prompt.items():
+        class_type = node_data.get("class_type", "")
+        if class_type and class_type not in class_to_id:
+            class_to_id[class_type] = str(node_id)
+    return title_to_id, class_to_id
+
+def get_node_lookup(prompt, extra_pnginfo):
+    return IMGNR_EXECUTION_MEMO.get(prompt, extra_pnginfo, "node_lookup", build_node_lookup)
 
 def format_comfy_string(text, prompt=None, extra_pnginfo=None):
     if not isinstance(text, str): 
         return text
+    return compile_filename_template(text).render(prompt, extra_pnginfo)
+
+# --- UTILITY: STAGE TIMER (enable with C.PROFILE_TIMINGS) ---
+class IMGNR_StageTimer:
+    def __init__(self, label):
+        self.label = label
+        self.stages = []
+        self.last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.stages.append((stage, now - self.last))
+        self.last = now
+
+    def report(self):
+        if not C.PROFILE_TIMINGS: return
+        total = sum(t for _, t in self.stages)
+        details = " | ".join(f"{stage}: {t * 1000:.1f}ms" for stage, t in self.stages)
+        print(f"{C.LOG_PREFIX} [Timing] {self.label} {total * 1000:.1f}ms -> {details}")
+
+# --- UTILITY: PNG CHUNKS ---
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+def png_chunk(chunk_type, data):
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data) & 0xFFFFFFFF)
+
+def png_text_chunk(key, value):
+    # Same choice as PIL's PngInfo.add_text: tEXt when latin-1 encodable, otherwise iTXt (UTF-8)
+    try:
+        return png_chunk(b"tEXt", key.encode("latin-1") + b"\0" + value.encode("latin-1"))
+    except UnicodeError:
+        return png_chunk(b"iTXt", key.encode("latin-1") + b"\0\0\0\0\0" + value.encode("utf-8"))
 
-    # 1. Resolve date variables
-    def format_date(match):
-        fmt = match.group(1)
-        fmt = fmt.replace("yyyy", "%Y").replace("yy", "%y")
-        fmt = fmt.replace("MM", "%m").replace("dd", "%d")
-        fmt = fmt.replace("HH", "%H").replace("mm", "%M").replace("ss", "%S")
+def png_size(png_bytes):
+    # IHDR is always the first chunk: width/height are the first 8 bytes of its data
+    return struct.unpack(">II", png_bytes[16:24])
+
+def png_ztxt_chunk(key, value):
+    # Compressed text: zTXt when latin-1 encodable, otherwise compressed iTXt (UTF-8).
+    # PIL refuses to open images with compressed text that inflates beyond MAX_TEXT_CHUNK (1 MB by default),
+    # so larger values stay plain tEXt, or LoadImage etc. would fail on the file.
+    try:
+        raw, chunk_type, header = value.encode("latin-1"), b"zTXt", b"\0\0"
+    except UnicodeError:
+        raw, chunk_type, header = value.encode("utf-8"), b"iTXt", b"\0\1\0\0\0"
+    if len(raw) > PngImagePlugin.MAX_TEXT_CHUNK:
+        return png_text_chunk(key, value)
+    return png_chunk(chunk_type, key.encode("latin-1") + header + zlib.compress(raw, 6))
+
+def png_insert_chunks(png_bytes, chunk_bytes):
+    # Splice ready-made chunks right after IHDR (8 byte signature + 25 byte IHDR chunk)
+    if not chunk_bytes: return png_bytes
+    return b"".join([png_bytes[:33], chunk_bytes, png_bytes[33:]])
+
+# --- WORKFLOW METADATA (serialized once per workflow) ---
+# The prompt / workflow JSON is serialized once per execution (IMGNR_EXECUTION_MEMO, shared with the node lookup;
+# the workflow cache reuses its hashes) and the finished PNG chunk bytes are cached by content hash,
+# so every further save just splices bytes.
+# "Sidecar JSON" writes the metadata once per unique workflow next to the outputs and the PNG only references it.
+METADATA_MODES = ["Embedded", "Embedded (Compressed)", "Sidecar JSON"]
+SIDECAR_DIR = "IMGNR_workflows"
+METADATA_CACHE_SIZE = 8
+
+class IMGNR_MetadataCache:
+    def __init__(self, size):
+        self.size = size
+        self.chunks = OrderedDict() # (hash, mode) -> PNG chunk bytes
+        self.sidecars = set() # sidecar files known to exist
+        self.lock = threading.Lock()
+
+    def serialize(self, prompt, extra_pnginfo):
+        # -> ([(key, json text)], content hash, ((prompt hash, size), (extra_pnginfo hash, size)))
+        return IMGNR_EXECUTION_MEMO.get(prompt, extra_pnginfo, "metadata", self.build)
+
+    @staticmethod
+    def build(prompt, extra_pnginfo):
+        texts = []
+        digest = hashlib.blake2b(digest_size=16)
+        prompt_part = extra_part = (None, 0)
+        if prompt is not None:
+            text = json_dumps_safe(prompt, default=str)
+            texts.append(("prompt", text))
+            digest.update(b"prompt\0" + text.encode("utf-8") + b"\0")
+            prompt_part = (digest.hexdigest(), len(text))
+        if extra_pnginfo is not None:
+            extra_digest = hashlib.blake2b(digest_size=16)
+            for x in extra_pnginfo:
+                text = json_dumps_safe(extra_pnginfo[x], default=str)
+                texts.append((x, text))
+                data = x.encode("utf-8") + b"\0" + text.encode("utf-8") + b"\0"
+                digest.update(data)
+                extra_digest.update(data)
+            extra_part = (extra_digest.hexdigest(), sum(len(v) for _, v in texts[1 if prompt is not None else 0:]))
+        return texts, digest.hexdigest(), (prompt_part, extra_part)
+
+    def texts(self, prompt, extra_pnginfo):
+        # -> ([(key, json text)], content hash)
+        return self.serialize(prompt, extra_pnginfo)[:2]
+
+    def chunk_bytes(self, prompt, extra_pnginfo, mode, output_dir):
+        if prompt is None and extra_pnginfo is None: return b""
+        texts, content_hash = self.texts(prompt, extra_pnginfo)
+        if mode == "Sidecar JSON":
+            rel_path = self.write_sidecar(texts, content_hash, output_dir)
+            return png_text_chunk("imgnr_workflow", rel_path)
+
+        key = (content_hash, mode)
+        with self.lock:
+            cached = self.chunks.get(key)
+            if cached is not None:
+                self.chunks.move_to_end(key)
+                return cached
+        make_chunk = png_ztxt_chunk if mode == "Embedded (Compressed)" else png_text_chunk
+        data = b"".join(make_chunk(k, v) for k, v in texts)
+        with self.lock:
+            self.chunks[key] = data
+            while len(self.chunks) > self.size:
+                self.chunks.popitem(last=False)
+        return data
+
+    def write_sidecar(self, texts, content_hash, output_dir):
+        # One JSON file per unique workflow: {"prompt": ..., "workflow": ...}; returns its path relative to output_dir
+        rel_path = f"{SIDECAR_DIR}/{content_hash}.json"
+        path = os.path.join(output_dir, SIDECAR_DIR, f"{content_hash}.json")
+        if path in self.sidecars: return rel_path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
         try:
-            return datetime.now().strftime(fmt)
-        except Exception:
-            return match.group(0)
-    
-    text = re.sub(r"%date:(.*?)%", format_date, text)
+            with open(path, "x", encoding="utf-8") as f:
+                f.write("{" + ", ".join(f"{json.dumps(k)}: {v}" for k, v in texts) + "}")
+        except FileExistsError:
+            pass
+        with self.lock:
+            self.sidecars.add(path)
+        return rel_path
 
-    # 2. Resolve ComfyUI node variables (e.g. %Empty Latent Image.width%)
-    if prompt:
-        title_to_id = {}
-        class_to_id = {}
-        
-        if extra_pnginfo and "workflow" in extra_pnginfo and "nodes" in extra_pnginfo["workflow"]:
-            for node in extra_pnginfo["workflow"]["nodes"]:
-                node_id = str(node.get("id"))
-                title = node.get("title", "")
-                class_type = node.get("type", "")
-                if title: title_to_id[title] = node_id
-                if class_type: class_to_id[class_type] = node_id
-        
-        # Fallback for prompt-only situations
-        for node_id, node_data in prompt.items():
-            class_type = node_data.get("class_type", "")
-            if class_type and class_type not in class_to_id:
-                class_to_id[class_type] = str(node_id)
-
-        def resolve_var(match):
-            var_path = match.group(1)
-            parts = var_path.rsplit(".", 1)
-            if len(parts) != 2:
-                return match.group(0)
-            
-            node_name, widget_name = parts
-            target_id = title_to_id.get(node_name) or class_to_id.get(node_name)
-            
-            if target_id and target_id in prompt:
-                inputs = prompt[target_id].get("inputs", {})
-                if widget_name in inputs:
-                    val = inputs[widget_name]
-                    # Handle primitive links implicitly (grabs evaluated values from upstream)
-                    if isinstance(val, list) and len(val) == 2: 
-                        link_id = str(val[0])
-                        if link_id in prompt:
-                            for k, v in prompt[link_id].get("inputs", {}).items():
-                                if not isinstance(v, list):
-                                    return str(v)
-                    return str(val)
-            return match.group(0)
-            
-        text = re.sub(r"%([^%]+)%", resolve_var, text)
-        
+IMGNR_METADATA_CACHE = IMGNR_MetadataCache(METADATA_CACHE_SIZE)
+
+# --- UTILITY: SAVE PATHS & DIRECTORY INDEX ---
+# Same prefix rules as folder_paths.get_save_image_path (%width%, %year%, subfolders, no escaping the
+# output folder), minus its os.listdir: we never use its counter, and listing a big folder on every save hurts.
+def compute_path_vars(text, image_width, image_height):
+    text = text.replace("%width%", str(image_width))
+    text = text.replace("%height%", str(image_height))
+    now = time.localtime()
+    text = text.replace("%year%", str(now.tm_year))
+    text = text.replace("%month%", str(now.tm_mon).zfill(2))
+    text = text.replace("%day%", str(now.tm_mday).zfill(2))
+    text = text.replace("%hour%", str(now.tm_hour).zfill(2))
+    text = text.replace("%minute%", str(now.tm_min).zfill(2))
+    text = text.replace("%second%", str(now.tm_sec).zfill(2))
     return text
 
+def resolve_save_path(filename_prefix, output_dir, image_width=0, image_height=0):
+    if "%" in filename_prefix:
+        filename_prefix = compute_path_vars(filename_prefix, image_width, image_height)
+
+    subfolder = os.path.dirname(os.path.normpath(filename_prefix))
+    filename = os.path.basename(os.path.normpath(filename_prefix))
+    full_output_folder = os.path.join(output_dir, subfolder)
+
+    if os.path.commonpath((output_dir, os.path.abspath(full_output_folder))) != output_dir:
+        raise ValueError(f"Saving image outside the output folder is not allowed. Folder: {os.path.abspath(full_output_folder)}")
+    return full_output_folder, filename, subfolder
+
+# File names per output folder, listed once and then kept up to date by our own saves.
+# A changed directory mtime (files added/removed by someone else) triggers a re-scan on next use.
+DIR_INDEX_MAX_FOLDERS = 64
+
+class IMGNR_DirIndex:
+    def __init__(self, max_folders):
+        self.max_folders = max_folders
+        self.folders = OrderedDict() # folder -> {"mtime": ns, "names": set, "suffix": {base: next _NNN}}
+        self.pending = {} # folder -> reserved names not written yet (kept across re-scans)
+        self.lock = threading.Lock()
+        self.scans = 0
+
+    @staticmethod
+    def dir_mtime(folder):
+        try:
+            return os.stat(folder).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def entry(self, folder):
+        # Caller holds self.lock
+        mtime = self.dir_mtime(folder)
+        entry = self.folders.get(folder)
+        if entry is not None and (entry["mtime"] == mtime or (self.pending.get(folder) and mtime is not None)):
+            # While our own saves are in flight they change the mtime too; foreign files are still caught by the exclusive create
+            entry["mtime"] = mtime
+            self.folders.move_to_end(folder)
+            return entry
+
+        if mtime is None:
+            os.makedirs(folder, exist_ok=True)
+            mtime = self.dir_mtime(folder)
+        with os.scandir(folder) as it:
+            names = {os.path.normcase(e.name) for e in it}
+        names |= self.pending.get(folder, set())
+        self.scans += 1
+        entry = {"mtime": mtime, "names": names, "suffix": {}}
+        self.folders[folder] = entry
+        self.folders.move_to_end(folder)
+        while len(self.folders) > self.max_folders:
+            self.folders.popitem(last=False)
+        return entry
+
+    def reserve(self, folder, base, ext, overwrite):
+        # Picks the file name under the index lock and marks it as taken right away, so concurrent saves
+        # sharing a prefix never pick the same one. Returns (file name, save status).
+        with self.lock:
+            entry = self.entry(folder)
+            names = entry["names"]
+            pending = self.pending.setdefault(folder, set())
+            name = base + ext
+            key = os.path.normcase(name)
+            if key not in names:
+                status = "new"
+            elif overwrite:
+                return name, "overwritten"
+            else:
+                # First "<base>_NNN<ext>" not taken. Resumes from the last suffix handed out for this base.
+                status = "saved_as"
+                idx = entry["suffix"].get(base, 1)
+                while os.path.normcase(f"{base}_{idx:03d}{ext}") in names:
+                    idx += 1
+                entry["suffix"][base] = idx + 1
+                name = f"{base}_{idx:03d}{ext}"
+                key = os.path.normcase(name)
+            names.add(key)
+            pending.add(key)
+            return name, status
+
+    def release(self, folder, name, exists):
+        # End of a save: exists=True keeps the name (our file, or a foreign one we collided with)
+        with self.lock:
+            key = os.path.normcase(name)
+            self.pending.get(folder, set()).discard(key)
+            entry = self.folders.get(folder)
+            if entry is None: return
+            if exists:
+                entry["names"].add(key)
+            else:
+                entry["names"].discard(key)
+            # The mtime change is ours, so the index stays valid
+            entry["mtime"] = self.dir_mtime(folder)
+
+    def stats(self):
+        with self.lock:
+            return {"folders": len(self.folders), "files": sum(len(e["names"]) for e in self.folders.values()), "scans": self.scans}
+
+IMGNR_DIR_INDEX = IMGNR_DirIndex(DIR_INDEX_MAX_FOLDERS)
+
+def open_reserved_file(folder, file_name, overwrite):
+    # New files are created exclusively ('xb'): if another process got there first we get None and pick another name.
+    # Overwrites go through a temp file + os.replace, so concurrent overwrites never interleave their bytes.
+    full_path = os.path.join(folder, file_name)
+    if overwrite:
+        tmp_path = os.path.join(folder, f".{file_name}.{os.getpid()}-{threading.get_ident()}.tmp")
+        return open(tmp_path, "wb"), tmp_path
+    try:
+        return open(full_path, "xb"), full_path
+    except FileExistsError:
+        return None, full_path
+
 # --- UTILITY: SAVE FUNCTION ---
-def save_image_to_disk(image_data_base64, filename_prefix, counter, add_counter, filename_extras, overwrite, embed_workflow=False, prompt=None, extra_pnginfo=None, output_dir=""):
+# Files written with skip_duplicates on: (pixel hash, metadata hash, mode, folder) -> (full path, relative path, name)
+SAVED_IMAGES_MAX = 4096
+
+class IMGNR_SavedImages:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None: return None
+        if not os.path.exists(entry[0]):
+            # Deleted (or moved) since: write it again
+            with self.lock:
+                self.entries.pop(key, None)
+            return None
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+IMGNR_SAVED_IMAGES = IMGNR_SavedImages(SAVED_IMAGES_MAX)
+
+def save_image_to_disk(image_data, filename_prefix, counter, add_counter, filename_extras, overwrite, embed_workflow=False, prompt=None, extra_pnginfo=None, output_dir="", batch_index=None, metadata_mode="Embedded", skip_duplicates=False):
     try:
-        # 1. Decode Image
-        if "," in image_data_base64:
-            image_data_base64 = image_data_base64.split(",")[1]
-        image_bytes = base64.b64decode(image_data_base64)
-        img = Image.open(io.BytesIO(image_bytes))
-
-        # 2. Handle Metadata (Workflow)
-        metadata = PngInfo()
-        if embed_workflow:
-            if prompt is not None:
-                metadata.add_text("prompt", json.dumps(prompt))
-            if extra_pnginfo is not None:
-                for x in extra_pnginfo:
-                    metadata.add_text(x, json.dumps(extra_pnginfo[x]))
+        timer = IMGNR_StageTimer("save_image_to_disk")
+
+        # 1. Resolve Image (PIL image, raw bytes, preview store URL or base64 data URI)
+        # Encoded PNGs are kept as bytes: they are written as-is with the metadata spliced in.
+        img = None
+        png_bytes = None
+        if isinstance(image_data, concurrent.futures.Future):
+            image_data = image_data.result() # Progressive preview: the full frame is still being encoded
+        if isinstance(image_data, Image.Image):
+            img = image_data
+        else:
+            if isinstance(image_data, (bytes, bytearray)):
+                image_bytes = bytes(image_data)
+            else:
+                stored = IMGNR_PREVIEW_STORE.get_by_url(image_data)
+                if stored is not None:
+                    image_bytes = stored[0]
+                elif image_data.startswith("data:") or PREVIEW_URL_PREFIX not in image_data:
+                    if "," in image_data:
+                        image_data = image_data.split(",")[1]
+                    image_bytes = base64.b64decode(image_data)
+                else:
+                    raise ValueError("Preview image expired from server memory. Please re-run the workflow.")
+            if image_bytes.startswith(PNG_SIGNATURE):
+                png_bytes = image_bytes
+            else:
+                img = Image.open(io.BytesIO(image_bytes))
+        img_width, img_height = png_size(png_bytes) if png_bytes is not None else img.size
+        timer.mark("decode")
+
+        full_output_dir = folder_paths.get_output_directory()
+        if output_dir: 
+             full_output_dir = output_dir
+
+        # 2. Handle Metadata (Workflow) - serialized once per workflow, see IMGNR_MetadataCache
+        metadata_chunks = IMGNR_METADATA_CACHE.chunk_bytes(prompt, extra_pnginfo, metadata_mode, full_output_dir) if embed_workflow else b""
+        timer.mark("metadata")
 
         # 3. Construct Filename
         if not filename_prefix: filename_prefix = "ComfyUI"
@@ -120,46 +1281,72 @@ def save_image_to_disk(image_data_base64, filename_prefix, counter, add_counter,
         filename_prefix = format_comfy_string(filename_prefix, prompt, extra_pnginfo)
 
         extras_str = f"_{filename_extras}" if filename_extras and filename_extras.strip() else ""
-        
-        full_output_dir = folder_paths.get_output_directory()
-        if output_dir: 
-             full_output_dir = output_dir
-        
-        # Resolve ComfyUI formatting natively (handles subfolders, %width%, etc.)
-        full_output_folder, filename_part, _, path_part, _ = folder_paths.get_save_image_path(filename_prefix, full_output_dir, img.width, img.height)
-        save_path = full_output_folder
 
-        if not os.path.exists(save_path):
-            os.makedirs(save_path)
+        # Batch saves: %batch_index% is replaced where the user put it, otherwise the index is appended
+        batch_str = ""
+        if batch_index is not None:
+            if BATCH_INDEX_TOKEN in filename_prefix or BATCH_INDEX_TOKEN in extras_str:
+                filename_prefix = filename_prefix.replace(BATCH_INDEX_TOKEN, batch_index)
+                extras_str = extras_str.replace(BATCH_INDEX_TOKEN, batch_index)
+            else:
+                batch_str = f"_{batch_index}"
+        
+        # Resolve ComfyUI formatting (handles subfolders, %width%, etc.)
+        save_path, filename_part, path_part = resolve_save_path(filename_prefix, full_output_dir, img_width, img_height)
 
         # LOGIC: Add Counter or Not?
         if add_counter:
             counter_str = f"_{int(counter):05d}"
-            base_filename_no_ext = f"{filename_part}{counter_str}{extras_str}"
+            base_filename_no_ext = f"{filename_part}{counter_str}{extras_str}{batch_str}"
         else:
-            base_filename_no_ext = f"{filename_part}{extras_str}"
+            base_filename_no_ext = f"{filename_part}{extras_str}{batch_str}"
 
         file_extension = ".png"
-        full_file_path = os.path.join(save_path, base_filename_no_ext + file_extension)
 
-        # 4. Handle Overwrite & Determine Save Status
-        final_base_name = base_filename_no_ext
-        save_status = "new"
-        
-        if os.path.exists(full_file_path):
-            if overwrite:
-                save_status = "overwritten"
-            else:
-                save_status = "saved_as"
-                safety_idx = 1
-                while os.path.exists(full_file_path):
-                    new_base = f"{base_filename_no_ext}_{safety_idx:03d}"
-                    full_file_path = os.path.join(save_path, new_base + file_extension)
-                    final_base_name = new_base
-                    safety_idx += 1
-
-        # 5. Save
-        img.save(full_file_path, pnginfo=metadata, compress_level=4)
+        # Same pixels + same metadata already saved to this folder under the same name (counter aside): hand back that file
+        duplicate_key = None
+        if skip_duplicates:
+            pixels = png_bytes if png_bytes is not None else img.tobytes()
+            meta_hash = IMGNR_METADATA_CACHE.texts(prompt, extra_pnginfo)[1] if embed_workflow else None
+            duplicate_key = (hashlib.blake2b(pixels, digest_size=16).hexdigest(), meta_hash, metadata_mode if embed_workflow else None, save_path, f"{filename_part}{extras_str}{batch_str}")
+            existing = IMGNR_SAVED_IMAGES.get(duplicate_key)
+            if existing is not None:
+                timer.report()
+                return (True, *existing[:2], int(counter), existing[2], "duplicate")
+
+        # 4. Handle Overwrite & Determine Save Status (name reserved in the directory index, no disk probing)
+        file_name, save_status = IMGNR_DIR_INDEX.reserve(save_path, base_filename_no_ext, file_extension, overwrite)
+        f, write_path = open_reserved_file(save_path, file_name, save_status == "overwritten")
+        while f is None:
+            # Someone outside this process created the name since the folder was indexed: take the next one
+            IMGNR_DIR_INDEX.release(save_path, file_name, True)
+            file_name, save_status = IMGNR_DIR_INDEX.reserve(save_path, base_filename_no_ext, file_extension, overwrite)
+            f, write_path = open_reserved_file(save_path, file_name, save_status == "overwritten")
+        full_file_path = os.path.join(save_path, file_name)
+        final_base_name = file_name[:-len(file_extension)]
+        timer.mark("filename")
+
+        # 5. Save (single encode)
+
+        try:
+            with f:
+                if png_bytes is None:
+                    buffer = io.BytesIO()
+                    img.save(buffer, format="PNG", compress_level=4)
+                    png_bytes = buffer.getvalue()
+                f.write(png_insert_chunks(png_bytes, metadata_chunks))
+            if write_path != full_file_path:
+                os.replace(write_path, full_file_path)
+        except Exception:
+            try:
+                os.remove(write_path)
+            except OSError:
+                pass
+            IMGNR_DIR_INDEX.release(save_path, file_name, save_status == "overwritten")
+            raise
+        IMGNR_DIR_INDEX.release(save_path, file_name, True)
+        timer.mark("encode+write")
+        timer.report()
         
         # 6. Return Data
         relative_path = os.path.relpath(full_file_path, folder_paths.get_output_directory())
@@ -172,6 +1359,9 @@ def save_image_to_disk(image_data_base64, filename_prefix, counter, add_counter,
             returned_full_string = os.path.join(path_part, final_base_name).replace("\\", "/")
         else:
             returned_full_string = final_base_name
+
+        if duplicate_key is not None:
+            IMGNR_SAVED_IMAGES.put(duplicate_key, (full_file_path, relative_path, returned_full_string))
         
         return True, full_file_path, relative_path, next_counter, returned_full_string, save_status
 
@@ -179,46 +1369,400 @@ def save_image_to_disk(image_data_base64, filename_prefix, counter, add_counter,
         print(f"{C.ERR_PREFIX} Save Error: {e}")
         return False, str(e), "", counter, "", "error"
 
-# --- API: MANUAL SAVE ---
-@PromptServer.instance.routes.post("/imgnr/save_manual")
-async def imgnr_save_manual(request):
+# --- BATCH AUTOSAVE ---
+# Every image of the batch is converted + PNG encoded on its own pool thread (PIL releases the GIL while
+# compressing, so this scales over the cores without copying frames to other processes).
+BATCH_INDEX_TOKEN = "%batch_index%"
+IMGNR_SAVE_WORKERS = max(1, os.cpu_count() or 1)
+IMGNR_SAVE_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=IMGNR_SAVE_WORKERS, thread_name_prefix="IMGNR_Save")
+
+def batch_index_str(index, batch_size):
+    # Zero padded to the batch size, so the files sort in batch order
+    return str(index).zfill(max(2, len(str(batch_size - 1))))
+
+def save_batch_to_disk(get_frame, batch_size, **save_kwargs):
+    # get_frame(index) -> image data for save_image_to_disk (called on the pool thread).
+    # Returns the save_image_to_disk results in batch order and throughput stats for the UI.
+    start = time.perf_counter()
+    if save_kwargs.get("embed_workflow"):
+        # Serialize the workflow before fanning out, instead of on every worker at once
+        IMGNR_METADATA_CACHE.chunk_bytes(save_kwargs.get("prompt"), save_kwargs.get("extra_pnginfo"), save_kwargs.get("metadata_mode", "Embedded"), save_kwargs.get("output_dir") or folder_paths.get_output_directory())
+
+    def save_frame(index):
+        return save_image_to_disk(get_frame(index), batch_index=batch_index_str(index, batch_size), **save_kwargs)
+
+    results = list(IMGNR_SAVE_POOL.map(save_frame, range(batch_size)))
+    seconds = max(time.perf_counter() - start, 1e-6)
+
+    written = 0
+    for success, full_path, *_ in results:
+        if success:
+            try:
+                written += os.path.getsize(full_path)
+            except OSError:
+                pass
+    saved = sum(1 for r in results if r[0])
+    stats = {
+        "images": saved,
+        "failed": len(results) - saved,
+        "seconds": round(seconds, 3),
+        "images_per_sec": round(saved / seconds, 2),
+        "mb_per_sec": round(written / seconds / (1024 * 1024), 1),
+        "workers": min(IMGNR_SAVE_WORKERS, batch_size)
+    }
+    if C.PROFILE_TIMINGS:
+        print(f"{C.LOG_PREFIX} [Timing] batch save {saved}/{len(results)} images in {seconds * 1000:.0f}ms ({stats['images_per_sec']} img/s, {stats['mb_per_sec']} MB/s)")
+    return results, stats
+
+def batch_save_summary(results):
+    # Single save_image_to_disk style result for the node: the first image's name, or the first error
+    failed = next((r for r in results if not r[0]), None)
+    if failed is not None:
+        # The counter still moves on if part of the batch made it to disk
+        return (False, failed[1], "", max(r[3] for r in results), "", "error")
+    return results[0]
+
+# --- BACKGROUND AUTOSAVE WRITER ---
+# Autosaves are handed to a single writer thread so slow (network) storage doesn't hold up the queue.
+# The queue is bounded: when it is full, the execution thread waits (backpressure) instead of piling up images.
+SAVE_QUEUE_DEPTH = 8
+
+class IMGNR_SaveWriter:
+    def __init__(self, max_depth):
+        self.jobs = queue.Queue(maxsize=max_depth)
+        self.thread = None
+        self.lock = threading.Lock()
+
+        self.next_id = 0
+
+    def submit(self, node_id, save_kwargs):
+        # Returns a save_id, so the UI can match the status event (which may arrive before "executed")
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="IMGNR_SaveWriter", daemon=True)
+                self.thread.start()
+            self.next_id += 1
+            save_id = self.next_id
+        self.jobs.put((save_id, node_id, save_kwargs))
+        return save_id
+
+    def _run(self):
+        while True:
+            save_id, node_id, save_kwargs = self.jobs.get()
+            try:
+                save_stats = None
+                if "get_frame" in save_kwargs:
+                    results, save_stats = save_batch_to_disk(**save_kwargs)
+                    success, full_path, rel_path, _, base_name, save_status = batch_save_summary(results)
+                else:
+                    success, full_path, rel_path, _, base_name, save_status = save_image_to_disk(**save_kwargs)
+                PromptServer.instance.send_sync("imgnr-save-status", {
+                    "node": node_id,
+                    "save_id": save_id,
+                    "success": success,
+                    "saved_filename": rel_path if success else None,
+                    "full_filename": base_name,
+                    "save_status": save_status,
+                    "save_stats": save_stats,
+                    "message": full_path
+                })
+            except Exception as e:
+                print(f"{C.ERR_PREFIX} [IMGNR_SaveWriter] Error: {e}")
+            finally:
+                self.jobs.task_done()
+
+    def flush(self, timeout=30):
+        # Wait for queued saves to hit the disk (called at shutdown)
+        deadline = time.monotonic() + timeout
+        while self.jobs.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        if self.jobs.unfinished_tasks:
+            print(f"{C.WARN_PREFIX} [IMGNR_SaveWriter] Shutdown with {self.jobs.unfinished_tasks} unsaved image(s).")
+
+IMGNR_SAVE_WRITER = IMGNR_SaveWriter(SAVE_QUEUE_DEPTH)
+atexit.register(IMGNR_SAVE_WRITER.flush)
+
+# --- API: PREVIEW STORE ---
+@PromptServer.instance.routes.get("/imgnr/preview/{name}")
+async def imgnr_get_preview(request):
+    digest = request.match_info["name"].split(".", 1)[0]
+    etag = f'"{digest}"'
+    if request.headers.get("If-None-Match") == etag:
+        return web.Response(status=304, headers={"ETag": etag})
+
+    entry = IMGNR_PREVIEW_STORE.get(digest)
+    if entry is None:
+        return web.Response(status=404, text="Preview expired")
+
+    data, mime = entry
+    return web.Response(body=data, content_type=mime, headers={
+        "ETag": etag,
+        # Content-addressed: the bytes behind a digest never change
+        "Cache-Control": "private, max-age=31536000, immutable"
+    })
+
+# --- API: REFERENCE STORE ---
+@PromptServer.instance.routes.get("/imgnr/ref/{name}")
+async def imgnr_get_ref(request):
+    ref_hash = request.match_info["name"].split(".", 1)[0]
+    etag = f'"{ref_hash}"'
+    if request.headers.get("If-None-Match") == etag:
+        return web.Response(status=304, headers={"ETag": etag})
+
+    entry = None
+    if IMGNR_RefStore.valid_hash(ref_hash):
+        # Lock + file read: off the event loop (a ring write may hold the lock)
+        entry = await asyncio.get_running_loop().run_in_executor(None, IMGNR_REF_STORE.get, ref_hash)
+    if entry is None:
+        return web.Response(status=404, text="Reference not found")
+
+    data, mime = entry
+    return web.Response(body=data, content_type=mime, headers={"ETag": etag, "Cache-Control": "private, max-age=31536000, immutable"})
+
+@PromptServer.instance.routes.get("/imgnr/refs")
+async def imgnr_list_refs(request):
+    refs = await asyncio.get_running_loop().run_in_executor(None, IMGNR_REF_STORE.list, request.query.get("node_id"))
+    return web.json_response({"refs": refs})
+
+@PromptServer.instance.routes.post("/imgnr/ref/pin")
+async def imgnr_pin_ref(request):
     data = await request.json()
-    
+    ref_hash = data.get("hash")
+    node_id = str(data.get("node_id", ""))
+    if not IMGNR_RefStore.valid_hash(ref_hash):
+        return web.json_response({"success": False, "message": "Invalid reference hash"}, status=400)
+
+    loop = asyncio.get_running_loop()
+    if not data.get("pinned", True):
+        await loop.run_in_executor(None, IMGNR_REF_STORE.unpin, ref_hash, node_id)
+        return web.json_response({"success": True})
+
+    # Not in the ring any more (e.g. old preview): take it from the preview store while it's still there
+    stored = IMGNR_PREVIEW_STORE.get(ref_hash)
+    entry = await loop.run_in_executor(None, IMGNR_REF_STORE.pin, ref_hash, node_id, *(stored or ()))
+    if entry is None:
+        return web.json_response({"success": False, "message": "Reference image no longer available"}, status=404)
+    return web.json_response({"success": True, "hash": ref_hash, "url": f"/imgnr/ref/{ref_hash}.{entry['ext']}"})
+
+# --- API: CACHE STATS ---
+def cache_stats():
+    return {
+        "workflow_cache": IMGNR_WORKFLOW_CACHE.stats(),
+        "preview_store": IMGNR_PREVIEW_STORE.stats(),
+        "dir_index": IMGNR_DIR_INDEX.stats(),
+        "frame_retention": IMGNR_FRAME_RETENTION.stats(),
+        "encode_cache": IMGNR_ENCODE_CACHE.stats(),
+        "ref_store": IMGNR_REF_STORE.stats()
+    }
+
+@PromptServer.instance.routes.get("/imgnr/cache_stats")
+async def imgnr_cache_stats(request):
+    # Every store takes its lock and the reference store may read its index from disk: not on the event loop
+    return web.json_response(await asyncio.get_running_loop().run_in_executor(None, cache_stats))
+
+# --- API: METADATA DIFF (Compare against a pinned / older reference) ---
+@PromptServer.instance.routes.post("/imgnr/meta_diff")
+async def imgnr_meta_diff(request):
+    data = await request.json()
+    diff = IMGNR_META_HISTORY.diff_hashes(data.get("current"), data.get("reference"))
+    if diff is None:
+        return web.json_response({"in_sync": False, "diff": []})
+    return web.json_response({"in_sync": True, "diff": diff})
+
+# --- API: MANUAL SAVE ---
+# Decoding, encoding and the disk write run on a small dedicated pool, never on the aiohttp event loop.
+# Requests beyond the pool + a short wait list are turned away with "busy" (the UI retries) instead of piling up.
+MANUAL_SAVE_WORKERS = 2
+MANUAL_SAVE_MAX_PENDING = 4
+IMGNR_MANUAL_SAVE_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=MANUAL_SAVE_WORKERS, thread_name_prefix="IMGNR_ManualSave")
+manual_save_pending = 0 # Only touched on the event loop
+
+def manual_save(data):
     # Extract cached workflow metadata
     node_id = str(data.get("node_id", ""))
-    cached_meta = IMGNR_WORKFLOW_CACHE.get(node_id, {})
+    cached_meta = IMGNR_WORKFLOW_CACHE.get(node_id)
+
+    # The image comes from the node's retained frames: "image" only says which preview is shown.
+    # Uploaded data URIs (and preview store URLs that are no longer retained) are the fallback.
+    image_data = data.get("image")
+    is_upload = isinstance(image_data, str) and image_data.startswith("data:")
+    frame = None if is_upload else IMGNR_FRAME_RETENTION.get(node_id, image_data)
+    if frame is None:
+        if not image_data or (not is_upload and IMGNR_PREVIEW_STORE.get_by_url(image_data) is None):
+            return {"success": False, "missing_image": True, "message": "Image no longer in server memory. Please re-run the workflow."}
+        frame = image_data
     
     success, full_path, rel_path, new_cnt, base_name, save_status = save_image_to_disk(
-        image_data_base64=data.get("image"),
+        image_data=frame,
         filename_prefix=data.get("filename_prefix"),
         counter=data.get("counter"),
         add_counter=data.get("add_counter"),
         filename_extras=data.get("filename_extras"),
         overwrite=data.get("overwrite"),
         embed_workflow=data.get("embed_workflow", True),
+        metadata_mode=data.get("metadata_mode") or "Embedded",
+        skip_duplicates=bool(data.get("skip_duplicates", False)),
         prompt=cached_meta.get("prompt", None),
         extra_pnginfo=cached_meta.get("extra_pnginfo", None)
     )
-    return web.json_response({
+    return {
         "success": success, 
         "message": full_path if success else rel_path, 
         "relative_path": rel_path,
         "new_counter": new_cnt,
         "save_status": save_status
-    })
+    }
+
+@PromptServer.instance.routes.post("/imgnr/save_manual")
+async def imgnr_save_manual(request):
+    global manual_save_pending
+    if manual_save_pending >= MANUAL_SAVE_MAX_PENDING:
+        return web.json_response({"success": False, "busy": True, "message": "Server is busy saving, please retry."}, status=429)
+
+    manual_save_pending += 1
+    try:
+        body = await request.read()
+        loop = asyncio.get_running_loop()
+        # Parsing an uploaded (fallback) data URI is heavy too: done on the pool as well
+        data = await loop.run_in_executor(IMGNR_MANUAL_SAVE_POOL, json.loads, body)
+        result = await loop.run_in_executor(IMGNR_MANUAL_SAVE_POOL, manual_save, data)
+    except Exception as e:
+        print(f"{C.ERR_PREFIX} Manual Save Error: {e}")
+        result = {"success": False, "message": str(e)}
+    finally:
+        manual_save_pending -= 1
+    return web.json_response(result)
 
 
 # --- BASE CLASS LOGIC ---
 class IMGNR_Preview_Base:
-    def tensor_to_pil(self, img_tensor):
+    COMPARE_META = False # Only the Compare node needs the metadata diff
+    SAVE_CONTROLS = True # Workflow + rendered frames are kept for SAVE NOW
+
+    def frame_array(self, img_tensor, index=0):
         if img_tensor.ndim == 3: img_tensor = img_tensor.unsqueeze(0)
-        arr = np.clip(255. * img_tensor[0].cpu().numpy(), 0, 255).astype(np.uint8)
-        
+        # One float temporary on the source device (mul), clamp in place, then cast: only uint8 crosses to host
+        return img_tensor[index].mul(255.).clamp_(0, 255).to(torch.uint8).cpu().numpy()
+
+    def array_to_pil(self, arr):
         # Explicitly enforce RGBA mode to prevent PIL from auto-stripping the alpha channel
         if arr.shape[-1] == 4:
             return Image.fromarray(arr, mode="RGBA")
         return Image.fromarray(arr, mode="RGB")
 
+    def tensor_to_pil(self, img_tensor, index=0):
+        return self.array_to_pil(self.frame_array(img_tensor, index))
+
+    def encode_png(self, pil_img):
+        buffer = io.BytesIO()
+        pil_img.save(buffer, format="PNG", compress_level=4)
+        return buffer.getvalue()
+
+    def encode_preview(self, pil_img, preview_format="PNG", preview_max_size=0, preview_quality=90):
+        # Returns (bytes, mime, lossless). Lossless means the bytes equal a full resolution PNG save.
+        img = pil_img
+        size = preview_size(img.width, img.height, preview_max_size)
+        if size != img.size:
+            img = img.resize(size, Image.BILINEAR)
+
+        fmt = preview_format if preview_format in PREVIEW_FORMATS else "PNG"
+        if fmt == "JPEG" and img.mode == "RGBA":
+            fmt = "WEBP" # JPEG has no alpha channel
+
+        if fmt == "PNG":
+            return self.encode_png(img), "image/png", img is pil_img
+
+        buffer = io.BytesIO()
+        if fmt == "JPEG":
+            img.save(buffer, format="JPEG", quality=int(preview_quality))
+        else:
+            img.save(buffer, format="WEBP", quality=int(preview_quality), method=0)
+        return buffer.getvalue(), f"image/{fmt.lower()}", False
+
+    def cached_frame(self, rgba_images, index, preview_opts):
+        # Encode of this exact (unmodified) tensor frame, without converting it
+        digest = IMGNR_ENCODE_CACHE.tensor_digest(rgba_images, index)
+        return IMGNR_ENCODE_CACHE.get(digest, tuple(sorted(preview_opts.items()))) if digest else None
+
+    def encode_frame(self, rgba_images, index, preview_opts, check_tensor=True):
+        # -> (pil_img, bytes, mime, lossless). Unchanged frames reuse their last encode (IMGNR_ENCODE_CACHE).
+        opts_key = tuple(sorted(preview_opts.items()))
+        cached = self.cached_frame(rgba_images, index, preview_opts) if check_tensor else None
+        if cached is not None:
+            return cached
+
+        arr = self.frame_array(rgba_images, index)
+        digest = IMGNR_EncodeCache.digest(arr)
+        IMGNR_ENCODE_CACHE.remember_tensor(rgba_images, index, digest)
+        cached = IMGNR_ENCODE_CACHE.get(digest, opts_key)
+        if cached is not None:
+            return cached
+
+        pil_img = self.array_to_pil(arr)
+        result = (pil_img, *self.encode_preview(pil_img, **preview_opts))
+        IMGNR_ENCODE_CACHE.put(digest, opts_key, result)
+        return result
+
+    def encode_thumbnail(self, rgba_images, index=0):
+        # Strided decimation + antialiased resize on the source device: only the thumbnail reaches the host
+        frame = rgba_images[index] if rgba_images.ndim == 4 else rgba_images
+        height, width = frame.shape[0], frame.shape[1]
+        thumb_w, thumb_h = preview_size(width, height, PROGRESSIVE_THUMB_EDGE)
+        step = max(1, min(width // thumb_w, height // thumb_h) // 2)
+        small = frame[::step, ::step].movedim(-1, 0).unsqueeze(0).float()
+        small = torch.nn.functional.interpolate(small, size=(thumb_h, thumb_w), mode="bilinear", antialias=True, align_corners=False)
+        arr = small[0].movedim(0, -1).mul(255.).clamp_(0, 255).to(torch.uint8).contiguous().cpu().numpy()
+
+        buffer = io.BytesIO()
+        thumb = self.array_to_pil(arr)
+        if thumb.mode == "RGBA":
+            thumb.save(buffer, format="WEBP", quality=PROGRESSIVE_THUMB_QUALITY, method=0)
+            return buffer.getvalue(), "image/webp"
+        thumb.save(buffer, format="JPEG", quality=PROGRESSIVE_THUMB_QUALITY)
+        return buffer.getvalue(), "image/jpeg"
+
+    def finish_preview(self, rgba_images, preview_opts, node_id_str, thumb_url):
+        # Background half of a progressive preview. Returns the frame SAVE NOW / autosave write.
+        try:
+            pil_img, data, mime, lossless = self.encode_frame(rgba_images, 0, preview_opts, check_tensor=False)
+            frame = data if lossless else pil_img
+            full_url = IMGNR_PREVIEW_STORE.put(data, mime)
+            ref_hash = None
+            if node_id_str is not None:
+                IMGNR_FRAME_RETENTION.update(node_id_str, thumb_url, {thumb_url: frame, full_url: frame})
+                if self.COMPARE_META:
+                    ref_hash = full_url.rsplit("/", 1)[1].split(".", 1)[0]
+                    IMGNR_REF_STORE.record(node_id_str, ref_hash, data, mime)
+                PromptServer.instance.send_sync("imgnr-preview-full", {"node": node_id_str, "thumb": thumb_url, "image": full_url, "ref_hash": ref_hash})
+            return frame
+        except Exception as e:
+            print(f"{C.ERR_PREFIX} [IMGNR_Preview] Full preview Error: {e}")
+            # The node keeps its thumbnail and shows the error; saves fall back to the plain full resolution frame
+            if node_id_str is not None:
+                PromptServer.instance.send_sync("imgnr-preview-full", {"node": node_id_str, "thumb": thumb_url, "image": None, "error": str(e)})
+            frame = self.tensor_to_pil(rgba_images, 0)
+            if node_id_str is not None:
+                IMGNR_FRAME_RETENTION.update(node_id_str, thumb_url, {thumb_url: frame})
+            return frame
+
+    def build_grid(self, rgba_images, indices):
+        # Tiles are downscaled so the whole grid costs roughly one full frame to encode
+        count = len(indices)
+        cols = math.ceil(math.sqrt(count))
+        rows = math.ceil(count / cols)
+        frame_h, frame_w = rgba_images.shape[1], rgba_images.shape[2]
+        tile_w = max(1, frame_w // cols)
+        tile_h = max(1, frame_h // cols)
+
+        def make_tile(index):
+            return self.tensor_to_pil(rgba_images, index).resize((tile_w, tile_h), Image.BILINEAR)
+
+        tiles = list(IMGNR_ENCODE_POOL.map(make_tile, indices))
+        grid = Image.new(tiles[0].mode, (tile_w * cols, tile_h * rows))
+        for i, tile in enumerate(tiles):
+            grid.paste(tile, ((i % cols) * tile_w, (i // cols) * tile_h))
+        return grid, cols, rows
+
     def prepare_rgba(self, images, mask=None):
         output_images = images
         output_mask = None
@@ -243,31 +1787,22 @@ class IMGNR_Preview_Base:
         
         return output_images, output_mask
 
-    # Helper to recursively sanitize JSON (convert NaN/Inf to None)
-    def clean_json(self, data):
-        if isinstance(data, dict):
-            return {k: self.clean_json(v) for k, v in data.items()}
-        elif isinstance(data, list):
-            return [self.clean_json(v) for v in data]
-        elif isinstance(data, float):
-            if math.isnan(data) or math.isinf(data):
-                return None
-        return data
-
     # Fixed signature: Now includes unique_id=None to handle ComfyUI's hidden inputs without crashing
-    def process_image(self, images, mask=None, filename_prefix="ComfyUI", counter=1, add_counter=True, filename_extras="", autosave=False, embed_workflow=True, overwrite=False, prompt=None, extra_pnginfo=None, unique_id=None):
+    def process_image(self, images, mask=None, filename_prefix="ComfyUI", counter=1, add_counter=True, filename_extras="", autosave=False, embed_workflow=True, overwrite=False, batch_preview="First Image", max_previews=16, preview_format="PNG", preview_max_size=0, preview_quality=90, background_save=False, autosave_batch=False, metadata_mode="Embedded", skip_duplicates=False, progressive_preview=True, prompt=None, extra_pnginfo=None, unique_id=None):
         ui_payload = []
+        node_id_str = None
+        save_id = None
         current_cnt = counter
         saved_rel_path = None 
         save_status = None
+        save_stats = None
+        ref_hash = None
         
         # Cache workflow for manual saves
         if unique_id is not None:
             node_id_str = str(unique_id[0]) if isinstance(unique_id, list) else str(unique_id)
-            IMGNR_WORKFLOW_CACHE[node_id_str] = {
-                "prompt": prompt,
-                "extra_pnginfo": extra_pnginfo
-            }
+            if self.SAVE_CONTROLS:
+                IMGNR_WORKFLOW_CACHE.put(node_id_str, prompt, extra_pnginfo)
         
         extras_str = f"_{filename_extras}" if filename_extras and filename_extras.strip() else ""
 
@@ -276,7 +1811,7 @@ class IMGNR_Preview_Base:
         height = images[0].shape[0] if (images is not None and len(images) > 0) else 0
         
         resolved_prefix = format_comfy_string(filename_prefix, prompt, extra_pnginfo)
-        _, formatted_name, _, formatted_subfolder, _ = folder_paths.get_save_image_path(resolved_prefix, folder_paths.get_output_directory(), width, height)
+        _, formatted_name, formatted_subfolder = resolve_save_path(resolved_prefix, folder_paths.get_output_directory(), width, height)
         resolved_filename_prefix = os.path.join(formatted_subfolder, formatted_name).replace("\\", "/") if formatted_subfolder else formatted_name
 
         # Default string generation BEFORE attempting autosave (Keeps full path structure)
@@ -293,46 +1828,134 @@ class IMGNR_Preview_Base:
              return {"ui": {"imgnr_b64_previews": []}, "result": (empty, empty, filename_prefix, current_cnt, "")}
 
         try:
-            pil_img = self.tensor_to_pil(rgba_images)
-            buffer = io.BytesIO()
-            pil_img.save(buffer, format="PNG", compress_level=4)
-            img_b64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-            data_uri = f"data:image/png;base64,{img_b64}"
+            timer = IMGNR_StageTimer("process_image")
+            batch_size = rgba_images.shape[0] if rgba_images.ndim == 4 else 1
+            indices = [0]
+            if batch_preview != "First Image" and batch_size > 1:
+                indices = select_batch_indices(batch_size, int(max_previews))
+
+            # Frame 0 (full resolution) is what the save path writes; extra frames are display only
+            preview_opts = {"preview_format": preview_format, "preview_max_size": int(preview_max_size), "preview_quality": int(preview_quality)}
+            extra_frames = []
+            grid_info = None
+            png_bytes = None
+            full_frame = None
+            display_w, display_h = rgba_images.shape[-2], rgba_images.shape[-3] # Full resolution size is what the node shows
+            if batch_preview == "All Images (Grid)" and len(indices) > 1:
+                grid_img, cols, rows = self.build_grid(rgba_images, indices)
+                grid_info = {"count": len(indices), "cols": cols, "rows": rows}
+                pil_img = self.tensor_to_pil(rgba_images, 0)
+                display_bytes, display_mime, grid_lossless = self.encode_preview(grid_img, **preview_opts)
+                display_w, display_h = grid_img.size
+                retained_first = display_bytes if grid_lossless else grid_img
+            elif (progressive_preview and len(indices) == 1 and max(preview_size(display_w, display_h, preview_opts["preview_max_size"])) >= PROGRESSIVE_MIN_EDGE
+                    and self.cached_frame(rgba_images, 0, preview_opts) is None):
+                # Progressive: thumbnail now, full preview from the encode pool (full_frame resolves to what gets saved)
+                display_bytes, display_mime = self.encode_thumbnail(rgba_images, 0)
+                thumb_url = IMGNR_PREVIEW_STORE.put(display_bytes, display_mime)
+                if node_id_str is not None:
+                    PromptServer.instance.send_sync("imgnr-preview-thumb", {"node": node_id_str, "image": thumb_url, "width": display_w, "height": display_h})
+                full_frame = IMGNR_ENCODE_POOL.submit(self.finish_preview, rgba_images, preview_opts, node_id_str, thumb_url)
+                retained_first = full_frame
+            else:
+                futures = [IMGNR_ENCODE_POOL.submit(self.encode_frame, rgba_images, i, preview_opts) for i in indices[1:]]
+                pil_img, display_bytes, display_mime, lossless = self.encode_frame(rgba_images, 0, preview_opts)
+                if lossless:
+                    png_bytes = display_bytes
+                retained_first = png_bytes if png_bytes is not None else pil_img
+                for i, future in zip(indices[1:], futures):
+                    frame_img, frame_bytes, frame_mime, frame_lossless = future.result()
+                    extra_frames.append((i, frame_img, IMGNR_PREVIEW_STORE.put(frame_bytes, frame_mime), frame_bytes if frame_lossless else frame_img))
+
+            timer.mark("preview encode")
+            preview_url = IMGNR_PREVIEW_STORE.put(display_bytes, display_mime)
+
+            # Compare node: the shown image goes into the on-disk reference ring (pinnable by hash)
+            ref_hash = None
+            if self.COMPARE_META and node_id_str is not None and full_frame is None:
+                ref_hash = preview_url.rsplit("/", 1)[1].split(".", 1)[0]
+                IMGNR_REF_STORE.record(node_id_str, ref_hash, display_bytes, display_mime)
+
+            # Keep what SAVE NOW writes (PNG bytes, or the full resolution frame behind a lossy preview)
+            if node_id_str is not None and self.SAVE_CONTROLS:
+                retained = {preview_url: retained_first}
+                retained.update({frame_url: frame for _, _, frame_url, frame in extra_frames})
+                IMGNR_FRAME_RETENTION.put(node_id_str, retained, preview_url)
             
-            if autosave:
-                 _, _, saved_rel_path, next_cnt, saved_base_name, save_status = save_image_to_disk(
-                     img_b64, filename_prefix, current_cnt, add_counter, filename_extras, overwrite, 
-                     embed_workflow, prompt, extra_pnginfo
-                 )
+            save_kwargs = {
+                "filename_prefix": filename_prefix, "counter": current_cnt, "add_counter": add_counter,
+                "filename_extras": filename_extras, "overwrite": overwrite, "embed_workflow": embed_workflow,
+                "metadata_mode": metadata_mode, "skip_duplicates": skip_duplicates, "prompt": prompt, "extra_pnginfo": extra_pnginfo
+            }
+            # Lossless preview bytes are reused as-is, otherwise the frame is encoded once (with metadata)
+            first_frame = full_frame or (png_bytes if png_bytes is not None else pil_img)
+            if autosave and autosave_batch and batch_size > 1:
+                 # Batch autosave: every image, one counter value, %batch_index% in the name
+                 def get_frame(index, rgba_images=rgba_images, first_frame=first_frame):
+                     return first_frame if index == 0 else self.tensor_to_pil(rgba_images, index)
+                 save_kwargs.update({"get_frame": get_frame, "batch_size": batch_size})
+            else:
+                 save_kwargs["image_data"] = first_frame
+
+            if autosave and background_save and node_id_str is not None:
+                 # Encoding and writing happen on the writer thread; the final name arrives via "imgnr-save-status"
+                 save_id = IMGNR_SAVE_WRITER.submit(node_id_str, save_kwargs)
+                 save_status = "queued"
+                 current_cnt = int(current_cnt) + 1 if add_counter else int(current_cnt)
+            elif autosave:
+                 if "get_frame" in save_kwargs:
+                     results, save_stats = save_batch_to_disk(**save_kwargs)
+                     saved = batch_save_summary(results)
+                 else:
+                     saved = save_image_to_disk(**save_kwargs)
+                 _, _, saved_rel_path, next_cnt, saved_base_name, save_status = saved
                  current_cnt = next_cnt
                  # Overwrite the default string with the exact full saved final name (including _001 overrides)
                  full_filename_str = saved_base_name 
+            timer.mark("autosave")
 
-            # Flatten relevant metadata for easy JS Diffing
-            raw_meta = {}
-            if prompt is not None:
-                raw_meta["prompt"] = prompt
-            
-            # SANITIZE: Ensure no NaNs get sent to frontend
-            meta_payload = self.clean_json(raw_meta)
+            # Compare node: server-side diff against this node's previous generation
+            meta_payload = None
+            if self.COMPARE_META and prompt is not None and node_id_str is not None:
+                meta_payload = IMGNR_META_HISTORY.record(node_id_str, prompt)
 
             ui_payload.append({
-                "image": data_uri,
-                "width": pil_img.width,
-                "height": pil_img.height,
+                "image": preview_url,
+                "ref_hash": ref_hash,
+                "width": display_w,
+                "height": display_h,
+                "batch_index": indices[0],
+                "batch_size": batch_size,
+                "grid": grid_info,
                 "current_counter": current_cnt,
                 "saved_filename": saved_rel_path,
                 "save_status": save_status,
+                "save_id": save_id,
+                "save_stats": save_stats,
                 "params": {
                     "filename_prefix": filename_prefix,
                     "filename_extras": filename_extras,
                     "add_counter": add_counter,
                     "overwrite": overwrite,
-                    "embed_workflow": embed_workflow
+                    "embed_workflow": embed_workflow,
+                    "metadata_mode": metadata_mode,
+                    "skip_duplicates": skip_duplicates
                 },
-                "meta": meta_payload # Passed to JS for A/B Diff
+                "meta": meta_payload # Passed to JS for A/B Diff (Compare node only)
             })
 
+            # List mode: remaining frames only carry what the frame selector needs
+            for idx, frame_img, frame_url, _ in extra_frames:
+                ui_payload.append({
+                    "image": frame_url,
+                    "width": frame_img.width,
+                    "height": frame_img.height,
+                    "batch_index": idx,
+                    "batch_size": batch_size
+                })
+            timer.mark("payload")
+            timer.report()
+
         except Exception as e:
             print(f"{C.ERR_PREFIX} [IMGNR_Preview] Error: {e}")
         
@@ -350,8 +1973,16 @@ class PreviewImageBase64Node(IMGNR_Preview_Base):
     def INPUT_TYPES(s):
         return {
             "required": { "images": ("IMAGE",) },
-            "optional": { "mask": ("MASK",) },
-            "hidden": {"prompt": "PROMPT", "extra_pnginfo": "EXTRA_PNGINFO"},
+            "optional": {
+                "mask": ("MASK",),
+                "batch_preview": (BATCH_PREVIEW_MODES, {"default": "First Image", "tooltip": "Preview only the first image, every image as a browsable list, or all images as one grid."}),
+                "max_previews": ("INT", {"default": 16, "min": 0, "max": 256, "step": 1, "tooltip": "Maximum number of batch images to preview, spread evenly over the batch. (0 = all)"}),
+                "preview_format": (PREVIEW_FORMATS, {"default": "PNG", "tooltip": "Codec for the on-canvas preview only. JPEG falls back to WEBP for transparent images. Saved files are always lossless PNG."}),
+                "preview_max_size": ("INT", {"default": 0, "min": 0, "max": 16384, "step": 64, "tooltip": "Downscale the preview so its longest edge fits this size. (0 = full resolution)"}),
+                "preview_quality": ("INT", {"default": 90, "min": 1, "max": 100, "step": 1, "tooltip": "Quality for JPEG/WEBP previews."}),
+                "progressive_preview": ("BOOLEAN", {"default": True, "tooltip": "Large previews (longest edge 2048px or more, single image) show a quick thumbnail first; the full preview replaces it once encoded in the background, so the workflow doesn't wait for it."}),
+            },
+            "hidden": {"prompt": "PROMPT", "extra_pnginfo": "EXTRA_PNGINFO", "unique_id": "UNIQUE_ID"},
         }
     
     RETURN_TYPES = ("IMAGE", "MASK")
@@ -359,9 +1990,11 @@ class PreviewImageBase64Node(IMGNR_Preview_Base):
     FUNCTION = "run"
     OUTPUT_NODE = True 
     CATEGORY = "IMGNR"
+    SAVE_CONTROLS = False
 
-    def run(self, images, mask=None, prompt=None, extra_pnginfo=None):
-        res = self.process_image(images, mask, prompt=prompt, extra_pnginfo=extra_pnginfo)
+    def run(self, images, mask=None, prompt=None, extra_pnginfo=None, unique_id=None, **preview_kwargs):
+        # unique_id: progressive previews are pushed to this node
+        res = self.process_image(images, mask, prompt=prompt, extra_pnginfo=extra_pnginfo, unique_id=unique_id, **preview_kwargs)
         return {"ui": res["ui"], "result": (res["result"][0], res["result"][1])}
 
 
@@ -387,6 +2020,16 @@ class PreviewImageAdHocSaveNode(IMGNR_Preview_Base):
             },
             "optional": {
                 "mask": ("MASK", ),
+                "batch_preview": (BATCH_PREVIEW_MODES, {"default": "First Image", "tooltip": "Preview only the first image, every image as a browsable list, or all images as one grid. Autosave writes the first image (or all, see autosave_batch), SAVE NOW saves the image shown."}),
+                "max_previews": ("INT", {"default": 16, "min": 0, "max": 256, "step": 1, "tooltip": "Maximum number of batch images to preview, spread evenly over the batch. (0 = all)"}),
+                "preview_format": (PREVIEW_FORMATS, {"default": "PNG", "tooltip": "Codec for the on-canvas preview only. JPEG falls back to WEBP for transparent images. Saved files are always lossless PNG."}),
+                "preview_max_size": ("INT", {"default": 0, "min": 0, "max": 16384, "step": 64, "tooltip": "Downscale the preview so its longest edge fits this size. (0 = full resolution)"}),
+                "preview_quality": ("INT", {"default": 90, "min": 1, "max": 100, "step": 1, "tooltip": "Quality for JPEG/WEBP previews."}),
+                "progressive_preview": ("BOOLEAN", {"default": True, "tooltip": "Large previews (longest edge 2048px or more, single image) show a quick thumbnail first; the full preview replaces it once encoded in the background, so the workflow doesn't wait for it."}),
+                "background_save": ("BOOLEAN", {"default": False, "tooltip": "Autosave on a background writer so the next prompt doesn't wait for the disk. full_filename then shows the expected name; the final name appears in the node once written."}),
+                "autosave_batch": ("BOOLEAN", {"default": False, "tooltip": "Autosave every image of the batch instead of only the first, encoded in parallel on all CPU cores. Put %batch_index% in filename_prefix or filename_extras to place the index, otherwise _<index> is appended. All images share one counter value."}),
+                "metadata_mode": (METADATA_MODES, {"default": "Embedded", "tooltip": "How embed_workflow stores the workflow. Embedded: plain PNG text (loads everywhere). Compressed: zTXt/iTXt chunks, smaller files, but ComfyUI's drag-and-drop loader only reads plain text chunks, so these images won't restore their workflow when dropped into ComfyUI; texts over 1 MB (e.g. large workflows) stay plain and uncompressed so PIL can still open the file. Sidecar JSON: one IMGNR_workflows/<hash>.json per unique workflow in the output folder, the PNG only references it."}),
+                "skip_duplicates": ("BOOLEAN", {"default": False, "tooltip": "Autosave / SAVE NOW: if the identical image (same pixels and workflow) was already saved to this folder with the same filename prefix/extras (counter aside), return that file instead of writing a duplicate. The counter doesn't advance, except with background_save: the counter is advanced before the writer knows it's a duplicate."}),
             },
             "hidden": {"prompt": "PROMPT", "extra_pnginfo": "EXTRA_PNGINFO", "unique_id": "UNIQUE_ID"},
         }
@@ -424,19 +2067,67 @@ class PreviewImageCompareNode(IMGNR_Preview_Base):
             },
             "optional": {
                 "mask": ("MASK", ),
+                "batch_preview": (BATCH_PREVIEW_MODES, {"default": "First Image", "tooltip": "Preview only the first image, every image as a browsable list, or all images as one grid. Autosave writes the first image (or all, see autosave_batch), SAVE NOW saves the image shown."}),
+                "max_previews": ("INT", {"default": 16, "min": 0, "max": 256, "step": 1, "tooltip": "Maximum number of batch images to preview, spread evenly over the batch. (0 = all)"}),
+                "preview_format": (PREVIEW_FORMATS, {"default": "PNG", "tooltip": "Codec for the on-canvas preview only. JPEG falls back to WEBP for transparent images. Saved files are always lossless PNG."}),
+                "preview_max_size": ("INT", {"default": 0, "min": 0, "max": 16384, "step": 64, "tooltip": "Downscale the preview so its longest edge fits this size. (0 = full resolution)"}),
+                "preview_quality": ("INT", {"default": 90, "min": 1, "max": 100, "step": 1, "tooltip": "Quality for JPEG/WEBP previews."}),
+                "progressive_preview": ("BOOLEAN", {"default": True, "tooltip": "Large previews (longest edge 2048px or more, single image) show a quick thumbnail first; the full preview replaces it once encoded in the background, so the workflow doesn't wait for it."}),
+                "background_save": ("BOOLEAN", {"default": False, "tooltip": "Autosave on a background writer so the next prompt doesn't wait for the disk. full_filename then shows the expected name; the final name appears in the node once written."}),
+                "autosave_batch": ("BOOLEAN", {"default": False, "tooltip": "Autosave every image of the batch instead of only the first, encoded in parallel on all CPU cores. Put %batch_index% in filename_prefix or filename_extras to place the index, otherwise _<index> is appended. All images share one counter value."}),
+                "metadata_mode": (METADATA_MODES, {"default": "Embedded", "tooltip": "How embed_workflow stores the workflow. Embedded: plain PNG text (loads everywhere). Compressed: zTXt/iTXt chunks, smaller files, but ComfyUI's drag-and-drop loader only reads plain text chunks, so these images won't restore their workflow when dropped into ComfyUI; texts over 1 MB (e.g. large workflows) stay plain and uncompressed so PIL can still open the file. Sidecar JSON: one IMGNR_workflows/<hash>.json per unique workflow in the output folder, the PNG only references it."}),
+                "skip_duplicates": ("BOOLEAN", {"default": False, "tooltip": "Autosave / SAVE NOW: if the identical image (same pixels and workflow) was already saved to this folder with the same filename prefix/extras (counter aside), return that file instead of writing a duplicate. The counter doesn't advance, except with background_save: the counter is advanced before the writer knows it's a duplicate."}),
+                "compare_against": (COMPARE_AGAINST, {"default": "Off", "tooltip": "Reference for the diff_heatmap / psnr / mae / ssim outputs. Off: no metrics (they cost about a second per run on large images), the outputs are zero. Auto: the reference pinned on this node in the queued workflow if there is one, otherwise the previous run (same as the slider). The pinned reference is the stored preview image, so lossy/downscaled previews give approximate scores."}),
             },
             "hidden": {"prompt": "PROMPT", "extra_pnginfo": "EXTRA_PNGINFO", "unique_id": "UNIQUE_ID"},
         }
 
-    RETURN_TYPES = ("IMAGE", "MASK", "STRING", "INT", "STRING")
-    RETURN_NAMES = ("image", "mask", "filename_prefix", "counter_out", "full_filename")
+    RETURN_TYPES = ("IMAGE", "MASK", "STRING", "INT", "STRING", "IMAGE", "FLOAT", "FLOAT", "FLOAT")
+    RETURN_NAMES = ("image", "mask", "filename_prefix", "counter_out", "full_filename", "diff_heatmap", "psnr", "mae", "ssim")
+    OUTPUT_TOOLTIPS = ("", "", "", "", "",
+                       "Per pixel difference to the reference (normalized per image).",
+                       "Batch mean PSNR in dB (100 = identical, 0 = no reference yet).",
+                       "Batch mean absolute error, 0..1.",
+                       "Batch mean structural similarity, 1 = identical.")
     FUNCTION = "run"
     OUTPUT_NODE = True 
     CATEGORY = "IMGNR"
+    COMPARE_META = True
 
-    def run(self, **kwargs):
+    def run(self, compare_against="Off", **kwargs):
         res = self.process_image(**kwargs)
-        return {"ui": res["ui"], "result": res["result"]}
+        heatmap, psnr, mae, ssim, metrics = self.compute_metrics(kwargs.get("images"), kwargs.get("unique_id"), kwargs.get("extra_pnginfo"), compare_against)
+        previews = res["ui"]["imgnr_b64_previews"]
+        if previews:
+            previews[0]["metrics"] = metrics
+        return {"ui": res["ui"], "result": res["result"] + (heatmap, psnr, mae, ssim)}
+
+    def compute_metrics(self, images, unique_id, extra_pnginfo, compare_against):
+        if images is None or len(images) == 0:
+            return torch.zeros([1, 64, 64, 3]), 0.0, 0.0, 0.0, None
+        if compare_against == "Off":
+            return torch.zeros_like(images[..., :3]), 0.0, 0.0, 0.0, None
+        node_id = str(unique_id[0]) if isinstance(unique_id, list) else str(unique_id)
+        previous = IMGNR_COMPARE_HISTORY.swap(node_id, images) if unique_id is not None else None
+        reference, against = None, None
+        try:
+            ref_hash = pinned_ref_hash(extra_pnginfo, node_id) if compare_against != "Previous Run" and unique_id is not None else None
+            if ref_hash is not None:
+                reference, against = pinned_reference_tensor(ref_hash), "pinned"
+            if reference is None and compare_against != "Pinned Reference":
+                reference, against = previous, "previous"
+            if reference is None:
+                return torch.zeros_like(images[..., :3]), 0.0, 0.0, 0.0, None
+
+            with torch.no_grad():
+                heatmap, psnr, mae, ssim = compare_metrics(images, reference)
+            psnr, mae, ssim = psnr.tolist(), mae.tolist(), ssim.tolist()
+            means = [sum(v) / len(v) for v in (psnr, mae, ssim)]
+            metrics = {"against": against, "psnr": psnr, "mae": mae, "ssim": ssim, "mean": dict(zip(("psnr", "mae", "ssim"), means))}
+            return heatmap, *means, metrics
+        except Exception as e:
+            print(f"{C.ERR_PREFIX} [IMGNR_Compare] Metrics Error: {e}")
+            return torch.zeros_like(images[..., :3]), 0.0, 0.0, 0.0, None
 
 
 # --- REGISTER NODES ---
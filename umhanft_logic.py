@@ -5,11 +5,46 @@
 # FEATURE: Dynamic Node alternative search
 # NEW: Added bonus + marker for bookmarked or already present nodes
 # DIAGNOSTIC: Added verbose debug logging for Active/Bookmark array matching
-
-import json, os, nodes, folder_paths, inspect, re
+# FIXED: Rescan only when the node registry changed (combined DB count never matched, every query rescanned)
+# OPTIMIZED: Per-node type/token sets + inverted token/type indexes, queries only score nodes sharing a token or unique type
+# OPTIMIZED: DB sync / INPUT_TYPES scan runs on a background thread after startup (ready/progress state, /umhanft/status)
+# OPTIMIZED: Incremental sync: per-node fingerprints (module, file mtime, RETURN_TYPES), only added/changed nodes rescanned
+# FIXED: DIY node fingerprints include their DIY-nodes .txt file's mtime (INPUT_TYPES is read from it)
+# OPTIMIZED: INPUT_TYPES harvested on parallel workers with a per-node timeout; slow-node timing report (umhanft_scan_report.json)
+# OPTIMIZED: Signatures stored in SQLite (interned types, pre-extracted tokens, descriptions loaded on demand); JSON still imported
+# FIXED: Fingerprints of INPUT_TYPES that raised are stored in the DB, so they aren't retried on every startup (timeouts are)
+# FIXED: DB rows keep their scan order ("seq"): equal scores are listed in registry order again, as with the JSON file
+
+import json, os, sys, nodes, folder_paths, inspect, re, threading, time, hashlib, queue, sqlite3, zlib
 from server import PromptServer
 from aiohttp import web
 from . import IMGNR_constants as C
+from . import diy_nodes
+
+UNIQUE_TYPES = {"MODEL", "LATENT", "VAE", "CLIP", "CONDITIONING", "CONTROL_NET", "IMAGE", "MASK", "AUDIO"}
+STANDARD_TYPES = {"STRING", "FLOAT", "INT", "BOOLEAN", "COMBO"}
+
+# INPUT_TYPES harvesting: many implementations wait on disk / network (file listings), so they run on threads.
+# A node exceeding the timeout is given up on (its daemon thread is abandoned and replaced).
+SCAN_WORKERS = 8
+SCAN_NODE_TIMEOUT = 10.0 # seconds
+SLOW_NODE_MS = 50 # Listed in the scan report from this INPUT_TYPES time on
+SCAN_REPORT_NAME = "umhanft_scan_report.json"
+
+# Signature DB: type names are interned (rows hold comma separated ids), name tokens are stored pre-extracted and the
+# long descriptions ("snr", zlib compressed) stay on disk until a query needs the target's.
+# Loading reads only the columns the index uses. "failed" holds the fingerprints of nodes whose INPUT_TYPES raised
+# (timeouts aren't kept: a node that was only slow once is retried on the next sync).
+# "seq" is the insertion order (registry order of the scan): ties in find_alternatives are listed in that order.
+DB_SCHEMA_VERSION = 1
+DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS types (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL);
+CREATE TABLE IF NOT EXISTS nodes (
+    name TEXT PRIMARY KEY, fp TEXT, inputs TEXT NOT NULL, outputs TEXT NOT NULL,
+    display TEXT, tokens TEXT NOT NULL, snr BLOB, seq INTEGER
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS failed (name TEXT PRIMARY KEY, fp TEXT) WITHOUT ROWID;
+"""
 
 class UMHANFT_Logic:
     def __init__(self):
@@ -17,34 +52,335 @@ class UMHANFT_Logic:
         
         # Use ComfyUI's official base_path
         base_path = getattr(folder_paths, "base_path", os.path.dirname(folder_paths.__file__))
-        self.user_db_path = os.path.join(base_path, "user", "umhanft_signatures.json")
+        self.user_db_path = os.path.join(base_path, "user", "umhanft_signatures.db")
+        self.legacy_db_path = os.path.join(base_path, "user", "umhanft_signatures.json") # Imported once, then unused
+        self.report_path = os.path.join(base_path, "user", SCAN_REPORT_NAME)
         
         try: os.makedirs(os.path.dirname(self.user_db_path), exist_ok=True)
         except: pass
 
         self.signatures = {}
+        self.index = None # Built on first query, see get_index()
+        self.index_key = None
+        self.pack_cache = {}
+        self.synced_classes = None # Registry snapshot (name -> class) of the last sync
+        self.failed = {} # name -> fingerprint of nodes whose INPUT_TYPES raised (not retried until they change, kept in the DB)
         if os.path.exists(self.user_db_path):
-            self.signatures = self.load_combined_db()
-        
-        self.sync_check()
+            try: self.signatures = self.load_combined_db()
+            except Exception as e: print(f"{C.ERR_PREFIX} [UMHANFT] Error reading DB {self.user_db_path}: {e}")
+
+        # Sync state: the check (and a rescan if needed) runs on a background thread once all packs are loaded.
+        # Until then queries are answered from the persisted DB.
+        self.state = "starting" # starting -> scanning -> ready
+        self.scan_done = 0
+        self.scan_total = 0
+        self.scan_seconds = None
+        self.scan_lock = threading.Lock()
+        self.scan_thread = None
+
+    def start_sync(self, rescan=False):
+        # rescan: full INPUT_TYPES scan of every node instead of the fingerprint diff
+        # At most one sync at a time; returns False if one is already running
+        with self.scan_lock:
+            if self.scan_thread is not None and self.scan_thread.is_alive():
+                return False
+            self.state = "scanning"
+            self.scan_thread = threading.Thread(target=self._run_sync, args=(rescan,), name="UMHANFT_Scan", daemon=True)
+            self.scan_thread.start()
+            return True
+
+    def _run_sync(self, rescan):
+        try:
+            if rescan: self.scan_all()
+            else: self.sync_check()
+        except Exception as e:
+            print(f"{C.ERR_PREFIX} [UMHANFT] Background scan failed: {e}")
+        finally:
+            self.state = "ready"
+
+    def ensure_synced(self):
+        # Registry changed since the last sync (classes compared by identity): sync in the background,
+        # keep answering from the current DB
+        if self.synced_classes is None:
+            if self.state == "starting": self.start_sync()
+        elif self.synced_classes != nodes.NODE_CLASS_MAPPINGS:
+            self.start_sync()
+
+    def status(self):
+        return {
+            "state": self.state,
+            "ready": self.state == "ready",
+            "progress": {"done": self.scan_done, "total": self.scan_total},
+            "nodes": len(self.signatures),
+            "scan_seconds": self.scan_seconds,
+            "report": self.report_path if os.path.exists(self.report_path) else None
+        }
+
+    @staticmethod
+    def file_mtime(path, mtimes):
+        if path not in mtimes:
+            try: mtimes[path] = os.stat(path).st_mtime_ns if path else 0
+            except OSError: mtimes[path] = 0
+        return mtimes[path]
+
+    def fingerprint(self, cls, mtimes):
+        # Cheap (no INPUT_TYPES call): defining module, its file's mtime, class name and RETURN_TYPES.
+        # Input types only change with the code, so a changed file marks all of its classes for a rescan.
+        # Exception: DIY nodes build INPUT_TYPES from their .txt file, whose mtime is added.
+        module = getattr(cls, "__module__", "") or ""
+        path = getattr(sys.modules.get(module), "__file__", None)
+        text = f"{module}|{self.file_mtime(path, mtimes)}|{getattr(cls, '__qualname__', '')}|{getattr(cls, 'RETURN_TYPES', ())!r}"
+        diy_file = diy_nodes.CLASS_TO_FILE_MAP.get(getattr(cls, "__name__", "")) if module == diy_nodes.__name__ else None
+        if diy_file:
+            text += f"|{self.file_mtime(os.path.join(diy_nodes.target_dir, diy_file), mtimes)}"
+        h = hashlib.blake2b(digest_size=8)
+        h.update(text.encode())
+        return h.hexdigest()
 
     def sync_check(self):
-        live_count = len(nodes.NODE_CLASS_MAPPINGS)
-        db_count = len(self.signatures)
-        if live_count != db_count:
-            print(f"{C.LOG_PREFIX} [UMHANFT] DB Sync Needed (Live: {live_count} vs DB: {db_count}). Scanning...")
-            self.scan_all()
-        else:
-            print(f"{C.LOG_PREFIX} [UMHANFT] Database loaded and synced ({db_count} nodes).")
+        # Fingerprint diff against the user DB: added / changed nodes are scanned (grouped by pack), removed ones dropped
+        installed = dict(nodes.NODE_CLASS_MAPPINGS)
+        self.synced_classes = installed
+        self.import_legacy_db()
+        user_fps = self.load_fingerprints()
+        self.failed = {name: fp for name, fp in self.load_failed().items() if name in installed}
+        mtimes = {}
+        live_fps = {name: self.fingerprint(cls, mtimes) for name, cls in installed.items()}
+        stale = [name for name, fp in live_fps.items() if user_fps.get(name) != fp and self.failed.get(name) != fp]
+        removed = [name for name in user_fps if name not in installed]
+
+        if not stale and not removed:
+            print(f"{C.LOG_PREFIX} [UMHANFT] Database loaded and synced ({len(user_fps)} nodes).")
+            if not self.signatures: self.signatures = self.load_combined_db()
+            return
+
+        by_pack = {}
+        for name in stale:
+            by_pack.setdefault(self.find_pack_name(installed[name]), []).append(name)
+        print(f"{C.LOG_PREFIX} [UMHANFT] DB Sync Needed ({len(stale)} new/changed in {len(by_pack)} pack(s), {len(removed)} removed). Scanning...")
+
+        start = time.perf_counter()
+        results = self.harvest([(name, installed[name], live_fps[name]) for names in by_pack.values() for name in names])
+        for pack, names in by_pack.items():
+            failed = 0
+            for name in names:
+                status = results[name][0]
+                if status == "ok":
+                    self.failed.pop(name, None)
+                    continue
+                removed.append(name)
+                failed += 1
+                if status == "failed": self.failed[name] = live_fps[name]
+                else: self.failed.pop(name, None) # Timed out: retried next sync
+            print(f"{C.LOG_PREFIX} [UMHANFT]   {pack}: {len(names) - failed} scanned" + (f", {failed} failed/timed out" if failed else ""))
+
+        scanned = {name: results[name][1] for name in stale if results[name][0] == "ok"} # Registry order
+        self.write_user_db(scanned, removed, failed=self.failed)
+        self.scan_seconds = round(time.perf_counter() - start, 2)
+        self.write_report(results, installed)
+        failed_count = len(stale) - len(scanned)
+        print(f"{C.LOG_PREFIX} [UMHANFT] Synced {len(scanned)} nodes in {self.scan_seconds}s" + (f", {failed_count} failed/timed out" if failed_count else "") + f" ({len(self.signatures)} signatures).")
+
+    def harvest(self, items):
+        # items: [(name, class, fingerprint)] -> {name: (status "ok" | "failed" | "timeout", signature | error, ms)}
+        # Own daemon threads instead of an executor: a hung INPUT_TYPES must neither stall the scan nor block shutdown.
+        self.scan_total = len(items)
+        self.scan_done = 0
+        jobs = queue.Queue()
+        for item in items: jobs.put(item)
+        done = queue.Queue()
+        running = {} # worker thread -> (node name, start)
+        lock = threading.Lock()
+
+        def worker():
+            me = threading.current_thread()
+            while True:
+                try: name, cls_obj, fp = jobs.get_nowait()
+                except queue.Empty: return
+                start = time.perf_counter()
+                with lock: running[me] = (name, start)
+                try: result = ("ok", self.scan_node(name, cls_obj, fp))
+                except Exception as e: result = ("failed", f"{type(e).__name__}: {e}")
+                with lock:
+                    if running.pop(me, None) is None: return # Timed out meanwhile: result dropped, a replacement took over
+                done.put((name, *result, (time.perf_counter() - start) * 1000))
+
+        def spawn():
+            threading.Thread(target=worker, name="UMHANFT_Harvest", daemon=True).start()
+
+        for _ in range(min(SCAN_WORKERS, len(items))): spawn()
+        results = {}
+        while len(results) < len(items):
+            try:
+                name, status, value, ms = done.get(timeout=0.1)
+                results[name] = (status, value, ms)
+                self.scan_done += 1
+            except queue.Empty: pass
+            now = time.perf_counter()
+            with lock:
+                stuck = [(t, name, start) for t, (name, start) in running.items() if now - start > SCAN_NODE_TIMEOUT]
+                for t, _, _ in stuck: del running[t]
+            for _, name, start in stuck:
+                print(f"{C.WARN_PREFIX} [UMHANFT] {name}.INPUT_TYPES() timed out after {SCAN_NODE_TIMEOUT}s, skipped.")
+                results[name] = ("timeout", None, (now - start) * 1000)
+                self.scan_done += 1
+                spawn()
+        return results
+
+    def write_report(self, results, installed):
+        # Slowest INPUT_TYPES first: the same calls make up ComfyUI's /object_info time
+        timings = sorted(((ms, name) for name, (_, _, ms) in results.items()), reverse=True)
+        report = {
+            "scanned_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "nodes": len(results),
+            "scan_seconds": self.scan_seconds,
+            "input_types_seconds": round(sum(ms for ms, _ in timings) / 1000, 2),
+            "workers": SCAN_WORKERS,
+            "timeout_seconds": SCAN_NODE_TIMEOUT,
+            "slow_ms": SLOW_NODE_MS,
+            "timed_out": sorted(name for name, (status, _, _) in results.items() if status == "timeout"),
+            "failed": {name: error for name, (status, error, _) in sorted(results.items()) if status == "failed"},
+            "slow": [{"name": name, "pack": self.find_pack_name(installed[name]), "ms": round(ms, 1)} for ms, name in timings if ms >= SLOW_NODE_MS]
+        }
+        try:
+            with open(self.report_path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+        except Exception as e:
+            print(f"{C.ERR_PREFIX} [UMHANFT] Error writing scan report to {self.report_path}: {e}")
+
+    def load_json_db(self, path):
+        if not os.path.exists(path): return {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except: return {}
+
+    def connect(self):
+        # One short-lived connection per operation: the DB is read on the event loop and written by the scan thread
+        conn = sqlite3.connect(self.user_db_path, timeout=10)
+        if conn.execute("PRAGMA user_version").fetchone()[0] != DB_SCHEMA_VERSION:
+            conn.executescript(DB_SCHEMA)
+            conn.execute(f"PRAGMA user_version = {DB_SCHEMA_VERSION}")
+        return conn
+
+    @staticmethod
+    def intern_ids(conn, values, cache):
+        # Type names -> "id,id,..." (order and duplicates kept), new names are added to the types table
+        ids = []
+        for value in values:
+            value_id = cache.get(value)
+            if value_id is None:
+                value_id = conn.execute("INSERT INTO types (name) VALUES (?)", (value,)).lastrowid
+                cache[value] = value_id
+            ids.append(str(value_id))
+        return ",".join(ids)
+
+    @staticmethod
+    def lookup_ids(text, names):
+        return list(map(names.__getitem__, map(int, text.split(",")))) if text else []
+
+    def write_user_db(self, scanned, removed=(), replace=False, failed=None):
+        # scanned: {name: signature} to insert/update, removed: names to delete, replace: drop every other row first,
+        # failed: {name: fingerprint} replacing the stored failures (None = unchanged)
+        try:
+            conn = self.connect()
+            try:
+                with conn:
+                    type_ids = {name: i for i, name in conn.execute("SELECT id, name FROM types")}
+                    if replace: conn.execute("DELETE FROM nodes")
+                    conn.executemany("DELETE FROM nodes WHERE name = ?", [(name,) for name in removed])
+                    # New rows are appended in scanned's order, updated rows keep their place
+                    next_seq = conn.execute("SELECT COALESCE(MAX(seq), -1) + 1 FROM nodes").fetchone()[0]
+                    rows = []
+                    for seq, (name, sig) in enumerate(scanned.items(), next_seq):
+                        display = nodes.NODE_DISPLAY_NAME_MAPPINGS.get(name, name)
+                        rows.append((
+                            name, sig.get("fp"),
+                            self.intern_ids(conn, self.ensure_hashable(sig.get("input_types", [])), type_ids),
+                            self.intern_ids(conn, self.ensure_hashable(sig.get("output_types", [])), type_ids),
+                            display,
+                            " ".join(sorted(self.extract_tokens(f"{display} {name}"))),
+                            zlib.compress(str(sig["snr"]).encode("utf-8")) if sig.get("snr") else None,
+                            seq
+                        ))
+                    conn.executemany(
+                        "INSERT INTO nodes (name, fp, inputs, outputs, display, tokens, snr, seq) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT(name) DO UPDATE SET fp = excluded.fp, inputs = excluded.inputs, outputs = excluded.outputs, "
+                        "display = excluded.display, tokens = excluded.tokens, snr = excluded.snr", rows)
+                    if failed is not None:
+                        conn.execute("DELETE FROM failed")
+                        conn.executemany("INSERT INTO failed (name, fp) VALUES (?, ?)", failed.items())
+            finally:
+                conn.close()
+            self.signatures = self.load_combined_db()
+        except Exception as e:
+            print(f"{C.ERR_PREFIX} [UMHANFT] Error writing DB to {self.user_db_path}: {e}")
+
+    def load_user_db(self):
+        # name -> signature without the description ("snr" is fetched by load_snr when needed)
+        if not os.path.exists(self.user_db_path): return {}
+        conn = self.connect()
+        try:
+            types = {i: name for i, name in conn.execute("SELECT id, name FROM types")}
+            type_lists = {} # Shared type combinations are decoded once: (list, set)
+            signatures = {}
+            for name, fp, inputs, outputs, display, token_text in conn.execute("SELECT name, fp, inputs, outputs, display, tokens FROM nodes ORDER BY seq"):
+                input_types = type_lists.get(inputs)
+                if input_types is None:
+                    decoded = self.lookup_ids(inputs, types)
+                    input_types = type_lists[inputs] = (decoded, frozenset(decoded))
+                output_types = type_lists.get(outputs)
+                if output_types is None:
+                    decoded = self.lookup_ids(outputs, types)
+                    output_types = type_lists[outputs] = (decoded, frozenset(decoded))
+                signatures[name] = {
+                    "input_types": input_types[0], "output_types": output_types[0], "fp": fp,
+                    "input_set": input_types[1], "output_set": output_types[1],
+                    "display": display, "tokens": frozenset(token_text.split())
+                }
+            return signatures
+        finally:
+            conn.close()
+
+    def load_fingerprints(self):
+        if not os.path.exists(self.user_db_path): return {}
+        conn = self.connect()
+        try: return dict(conn.execute("SELECT name, fp FROM nodes"))
+        finally: conn.close()
+
+    def load_failed(self):
+        if not os.path.exists(self.user_db_path): return {}
+        conn = self.connect()
+        try: return dict(conn.execute("SELECT name, fp FROM failed"))
+        finally: conn.close()
+
+    def load_snr(self, name):
+        if not os.path.exists(self.user_db_path): return ""
+        conn = self.connect()
+        try:
+            row = conn.execute("SELECT snr FROM nodes WHERE name = ?", (name,)).fetchone()
+            return zlib.decompress(row[0]).decode("utf-8") if row and row[0] is not None else ""
+        finally:
+            conn.close()
+
+    def import_json(self, path):
+        # JSON signature files ({name: {input_types, output_types, snr[, fp]}}) into the DB
+        data = self.load_json_db(path)
+        entries = {name: sig for name, sig in data.items() if isinstance(sig, dict)}
+        if entries: self.write_user_db(entries)
+        return len(entries)
+
+    def import_legacy_db(self):
+        # One-time migration of the old umhanft_signatures.json. It has no fingerprints, so the first sync
+        # rescans every node once; until then queries are answered from the imported signatures.
+        if os.path.exists(self.user_db_path) or not os.path.exists(self.legacy_db_path): return
+        count = self.import_json(self.legacy_db_path)
+        print(f"{C.LOG_PREFIX} [UMHANFT] Imported {count} signatures from {self.legacy_db_path}.")
 
     def load_combined_db(self):
-        combined = {}
-        for path in [self.base_db_path, self.user_db_path]:
-            if os.path.exists(path):
-                try:
-                    with open(path, 'r', encoding='utf-8') as f:
-                        combined.update(json.load(f))
-                except: continue
+        # Base JSON (shipped) underneath the user DB
+        combined = self.load_json_db(self.base_db_path)
+        combined.update(self.load_user_db())
         return combined
 
     def ensure_hashable(self, data_list):
@@ -54,6 +390,13 @@ class UMHANFT_Logic:
     def get_pack_name(self, node_name):
         cls = nodes.NODE_CLASS_MAPPINGS.get(node_name)
         if not cls: return "(Missing)"
+        cached = self.pack_cache.get(node_name)
+        if cached is not None and cached[0] is cls: return cached[1]
+        pack = self.find_pack_name(cls)
+        self.pack_cache[node_name] = (cls, pack)
+        return pack
+
+    def find_pack_name(self, cls):
         try:
             source_file = inspect.getfile(cls)
             if "custom_nodes" in source_file:
@@ -64,38 +407,47 @@ class UMHANFT_Logic:
             return "(Core)"
         except: return "(Core)"
 
+    def scan_node(self, name, cls_obj, fp):
+        inputs_info = cls_obj.INPUT_TYPES()
+        required_inputs = inputs_info.get("required", {})
+        
+        input_types = []
+        for v in required_inputs.values():
+            raw_type = v[0] if isinstance(v, tuple) else v
+            if isinstance(raw_type, list):
+                input_types.append("COMBO")
+            else:
+                input_types.append(str(raw_type))
+
+        output_types = [str(t) for t in getattr(cls_obj, "RETURN_TYPES", [])]
+        snr_name = getattr(cls_obj, "DESCRIPTION", name) 
+        
+        return {
+            "input_types": input_types, 
+            "output_types": output_types,
+            "snr": str(snr_name),
+            "fp": fp
+        }
+
     def scan_all(self):
-        installed = nodes.NODE_CLASS_MAPPINGS
+        # Full rescan (ignores fingerprints)
+        installed = dict(nodes.NODE_CLASS_MAPPINGS) # Snapshot: packs may still register while this runs
+        self.synced_classes = installed
+        start = time.perf_counter()
+        mtimes = {}
+        fps = {name: self.fingerprint(cls_obj, mtimes) for name, cls_obj in installed.items()}
+        results = self.harvest([(name, cls_obj, fps[name]) for name, cls_obj in installed.items()])
         user_scan = {}
-        for name, cls_obj in installed.items():
-            try:
-                inputs_info = cls_obj.INPUT_TYPES()
-                required_inputs = inputs_info.get("required", {})
-                
-                input_types = []
-                for v in required_inputs.values():
-                    raw_type = v[0] if isinstance(v, tuple) else v
-                    if isinstance(raw_type, list):
-                        input_types.append("COMBO")
-                    else:
-                        input_types.append(str(raw_type))
-
-                output_types = [str(t) for t in getattr(cls_obj, "RETURN_TYPES", [])]
-                snr_name = getattr(cls_obj, "DESCRIPTION", name) 
-                
-                user_scan[name] = {
-                    "input_types": input_types, 
-                    "output_types": output_types,
-                    "snr": str(snr_name)
-                }
-            except: continue
+        self.failed = {}
+        for name in installed: # Registry order, not completion order
+            status, value, _ = results[name]
+            if status == "ok": user_scan[name] = value
+            elif status == "failed": self.failed[name] = fps[name]
         
-        try:
-            with open(self.user_db_path, 'w', encoding='utf-8') as f:
-                json.dump(user_scan, f, indent=2)
-            self.signatures = self.load_combined_db()
-        except Exception as e:
-            print(f"{C.ERR_PREFIX} [UMHANFT] Error writing DB to {self.user_db_path}: {e}")
+        self.write_user_db(user_scan, replace=True, failed=self.failed)
+        self.scan_seconds = round(time.perf_counter() - start, 2)
+        self.write_report(results, installed)
+        print(f"{C.LOG_PREFIX} [UMHANFT] Scanned {len(user_scan)} nodes in {self.scan_seconds}s.")
 
     def extract_tokens(self, text):
         if not text: return set()
@@ -103,10 +455,43 @@ class UMHANFT_Logic:
         text = re.sub(r'[^a-zA-Z0-9]', ' ', text)
         return {w.lower() for w in text.split() if len(w) >= 3}
 
+    def build_index(self):
+        # Per installed node: type sets, display name and name tokens, computed once instead of per query.
+        # Inverted indexes map a token / unique type to the nodes that have it (the only nodes a query can score).
+        index = {"nodes": {}, "by_token": {}, "by_input": {}, "by_output": {}}
+        for order, (name, sig) in enumerate(self.signatures.items()):
+            if name not in nodes.NODE_CLASS_MAPPINGS: continue
+            disp_name = nodes.NODE_DISPLAY_NAME_MAPPINGS.get(name, name)
+            # Tokens stored with the signature are reused while the display name is unchanged
+            tokens = sig.get("tokens") if sig.get("display") == disp_name else None
+            entry = {
+                "order": order,
+                "display": disp_name,
+                "in": sig.get("input_set") or set(self.ensure_hashable(sig.get("input_types", []))),
+                "out": sig.get("output_set") or set(self.ensure_hashable(sig.get("output_types", []))),
+                "tokens": tokens if tokens is not None else self.extract_tokens(f"{disp_name} {name}")
+            }
+            index["nodes"][name] = entry
+            for token in entry["tokens"]:
+                index["by_token"].setdefault(token, set()).add(name)
+            for t in entry["in"] & UNIQUE_TYPES:
+                index["by_input"].setdefault(t, set()).add(name)
+            for t in entry["out"] & UNIQUE_TYPES:
+                index["by_output"].setdefault(t, set()).add(name)
+        return index
+
+    def get_index(self):
+        # Other packs keep registering nodes after this one loads: rebuild when the registry or DB changed
+        key = (id(self.signatures), len(self.signatures), len(nodes.NODE_CLASS_MAPPINGS), len(nodes.NODE_DISPLAY_NAME_MAPPINGS))
+        if self.index is None or self.index_key != key:
+            self.index = self.build_index()
+            self.index_key = key
+        return self.index
+
     def find_alternatives(self, target_node_type, target_title=None, neighbors=None, live_sig=None, strict=True, min_score=50, max_alts=15, strict_connected=False, debug_enabled=False, debug_filter="", active_nodes=None, bookmarked_nodes=None):
         
-        if len(self.signatures) != len(nodes.NODE_CLASS_MAPPINGS):
-            self.scan_all()
+        self.ensure_synced()
+        index = self.get_index()
 
         target_sig = self.signatures.get(target_node_type)
         if not target_sig and live_sig:
@@ -124,7 +509,7 @@ class UMHANFT_Logic:
         target_out = set(self.ensure_hashable(target_sig.get("output_types", [])))
         target_in = set(self.ensure_hashable(target_sig.get("input_types", [])))
         
-        target_snr = str(target_sig.get("snr", ""))
+        target_snr = str(target_sig["snr"] if "snr" in target_sig else self.load_snr(target_node_type))
         raw_target_text = f"{target_title or ''} {target_node_type} {target_snr}"
         target_tokens = self.extract_tokens(raw_target_text)
 
@@ -143,12 +528,23 @@ class UMHANFT_Logic:
             if debug_filter:
                 print(f"{C.WARN_PREFIX} Debug Filter Active: Only showing logs for '{debug_filter}'")
 
-        for name, sig in self.signatures.items():
-            if name == target_node_type: continue
-            if name not in nodes.NODE_CLASS_MAPPINGS: continue
-            
-            sig_out = set(self.ensure_hashable(sig.get("output_types", [])))
-            sig_in = set(self.ensure_hashable(sig.get("input_types", [])))
+        # Candidates: nodes sharing a name token or a unique type with the target (anything else fails the junk filter)
+        candidates = set()
+        for token in target_tokens:
+            candidates |= index["by_token"].get(token, set())
+        for t in target_in & UNIQUE_TYPES:
+            candidates |= index["by_input"].get(t, set())
+        for t in target_out & UNIQUE_TYPES:
+            candidates |= index["by_output"].get(t, set())
+        if debug_enabled and debug_filter:
+            candidates |= {name for name in index["nodes"] if debug_filter.lower() in name.lower()}
+        candidates.discard(target_node_type)
+
+        node_index = index["nodes"]
+        for name in sorted(candidates, key=lambda n: node_index[n]["order"]):
+            entry = node_index[name]
+            sig_out = entry["out"]
+            sig_in = entry["in"]
 
             # Debug Trigger for specific node
             should_debug_this = debug_enabled and debug_filter and (debug_filter.lower() in name.lower())
@@ -165,18 +561,16 @@ class UMHANFT_Logic:
 
             # Scoring
             score = 0
-            disp_name = nodes.NODE_DISPLAY_NAME_MAPPINGS.get(name, name)
+            disp_name = entry["display"]
             
-            candidate_tokens = self.extract_tokens(f"{disp_name} {name}")
-            common_tokens = target_tokens.intersection(candidate_tokens)
+            common_tokens = target_tokens.intersection(entry["tokens"])
             
             name_score = 0
             if common_tokens:
                 name_score = 30 + (len(common_tokens) * 20)
                 score += name_score
 
-            unique_types = {"MODEL", "LATENT", "VAE", "CLIP", "CONDITIONING", "CONTROL_NET", "IMAGE", "MASK", "AUDIO"}
-            matched_unique = (target_in & sig_in & unique_types) | (target_out & sig_out & unique_types)
+            matched_unique = (target_in & sig_in & UNIQUE_TYPES) | (target_out & sig_out & UNIQUE_TYPES)
             
             if matched_unique: score += 50 
 
@@ -186,8 +580,7 @@ class UMHANFT_Logic:
                     print(f"{C.WARN_PREFIX} [REJECT] {name}: No Name Match & No Unique Type")
                 continue
 
-            standard_types = {"STRING", "FLOAT", "INT", "BOOLEAN", "COMBO"}
-            matched_standard = (target_in & sig_in & standard_types) | (target_out & sig_out & standard_types)
+            matched_standard = (target_in & sig_in & STANDARD_TYPES) | (target_out & sig_out & STANDARD_TYPES)
             
             if matched_standard:
                 if name_score > 0 or matched_unique: score += 15
@@ -261,10 +654,31 @@ class UMHANFT_Logic:
 
 logic_instance = UMHANFT_Logic()
 
+# Sync after every pack has registered its nodes (the server starts after node loading), without blocking startup
+async def umhanft_startup(app):
+    logic_instance.start_sync()
+
+PromptServer.instance.app.on_startup.append(umhanft_startup)
+
+@PromptServer.instance.routes.get("/umhanft/status")
+async def umhanft_status_handler(request):
+    return web.json_response(logic_instance.status())
+
+# Full rescan, e.g. to refresh the slow-node report for the whole install
+@PromptServer.instance.routes.post("/umhanft/rescan")
+async def umhanft_rescan_handler(request):
+    started = logic_instance.start_sync(rescan=True)
+    return web.json_response({"started": started, "status": logic_instance.status()})
+
 @PromptServer.instance.routes.post("/umhanft/find_alternatives")
 async def find_alt_handler(request):
     data = await request.json()
     node_type = data.get("node_type")
+
+    # First scan still running and no persisted DB to answer from yet
+    logic_instance.ensure_synced()
+    if not logic_instance.signatures:
+        return web.json_response({"alternatives": [], "current_pack": logic_instance.get_pack_name(node_type), "count": 0, "warming_up": True, "status": logic_instance.status()})
     
     alts = logic_instance.find_alternatives(
         node_type, 
@@ -280,7 +694,7 @@ async def find_alt_handler(request):
         active_nodes=data.get("active_nodes", []),
         bookmarked_nodes=data.get("bookmarked_nodes", [])
     )
-    return web.json_response({"alternatives": alts, "current_pack": logic_instance.get_pack_name(node_type), "count": len(alts)})
+    return web.json_response({"alternatives": alts, "current_pack": logic_instance.get_pack_name(node_type), "count": len(alts), "warming_up": not logic_instance.status()["ready"]})
 
 NODE_CLASS_MAPPINGS = {}
 NODE_DISPLAY_NAME_MAPPINGS = {}
\ No newline at end of file